@@ -4,6 +4,31 @@ import '../styles/ChatbotUI.css';
 import '../styles/LoadingSpinner.css';
 import { getAuth } from 'firebase/auth';
 
+// Reads a text/event-stream response body and calls onEvent(eventName, data) for each event.
+const readServerSentEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    const rawEvents = buffer.split('\n\n');
+    buffer = rawEvents.pop();
+    for (const rawEvent of rawEvents) {
+      let eventName = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event: ')) eventName = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (data) onEvent(eventName, JSON.parse(data));
+    }
+  }
+};
+
 const ChatbotUI = () => {
   const [isOpen, setIsOpen] = useState(false);
   const [messages, setMessages] = useState([]);
@@ -35,7 +60,7 @@ const ChatbotUI = () => {
         throw new Error("User not authenticated. Please log in to use the chatbot.");
       }
       const idToken = await user.getIdToken();
-      const apiUrl = 'http://localhost:8000/predict-disease';
+      const apiUrl = 'http://localhost:8000/predict-disease/stream';
 
       const response = await fetch(apiUrl, {
         method: 'POST',
@@ -51,10 +76,31 @@ const ChatbotUI = () => {
         throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      
+      // Render tokens as they arrive instead of waiting for the full answer.
+      const botId = Date.now() + '_bot';
+      let data = null;
+      await readServerSentEvents(response, (eventName, payload) => {
+        if (eventName === 'error') {
+          throw new Error(payload.detail || 'The AI assistant failed to respond.');
+        }
+        if (eventName === 'done') {
+          data = payload;
+          return;
+        }
+        setIsLoading(false);
+        setMessages((prevMessages) => (
+          prevMessages.some((message) => message.id === botId)
+            ? prevMessages.map((message) => (message.id === botId ? { ...message, text: message.text + payload.token } : message))
+            : [...prevMessages, { id: botId, text: payload.token, sender: 'bot' }]
+        ));
+      });
+
+      if (!data) {
+        throw new Error('The response stream ended unexpectedly.');
+      }
+
       const botResponse = { 
-        id: Date.now() + '_bot', 
+        id: botId, 
         text: data.response_text, 
         sender: 'bot'
       };
@@ -66,7 +112,11 @@ const ChatbotUI = () => {
         isDisclaimer: true
       };
 
-      setMessages((prevMessages) => [...prevMessages, botResponse, disclaimerResponse]);
+      setMessages((prevMessages) => [
+        ...prevMessages.filter((message) => message.id !== botId),
+        botResponse,
+        disclaimerResponse,
+      ]);
 
     } catch (error) {
       console.error('Error sending message:', error);
@@ -5,6 +5,7 @@ import { useAuth } from "../contexts/AuthContext"; // To get the user's ID token
 
 // Define your API base URL
 const API_BASE_URL = "http://localhost:8000/api/v1"; // Adjust if your backend is on a different host/port/prefix
+const PAGE_SIZE = 500;
 
 const ProductManager = () => {
   const { currentUser } = useAuth(); // Get currentUser from AuthContext
@@ -49,10 +50,18 @@ const ProductManager = () => {
         setLoading(false);
         return; // Don't fetch if no auth token
       }
-      const response = await axios.get(`${API_BASE_URL}/products`, {
-        headers,
-      });
-      setProducts(response.data);
+      // The API returns one page at a time; follow the cursor until the last page.
+      const allProducts = [];
+      let cursor = null;
+      do {
+        const response = await axios.get(`${API_BASE_URL}/products`, {
+          headers,
+          params: { limit: PAGE_SIZE, ...(cursor && { start_after: cursor }) },
+        });
+        allProducts.push(...response.data);
+        cursor = response.headers["x-next-cursor"];
+      } while (cursor);
+      setProducts(allProducts);
     } catch (err) {
       console.error("Error fetching products:", err);
       setError(
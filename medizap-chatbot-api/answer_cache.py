@@ -0,0 +1,154 @@
+# answer_cache.py
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(text: str) -> str:
+    """Lowercases a question and strips punctuation and extra whitespace."""
+    return _WHITESPACE_RE.sub(' ', _PUNCTUATION_RE.sub(' ', text.lower())).strip()
+
+
+def make_cache_key(query: str, context: str) -> str:
+    context_hash = hashlib.sha256(context.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{normalize_query(query)}\0{context_hash}".encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    Two-tier cache of generated answers keyed by (normalized query, context hash).
+
+    The first tier is an in-process LRU; the second is a SQLite file shared by
+    every worker on the host and surviving restarts. Both tiers expire entries
+    after `ttl` seconds and evict least-recently-used entries beyond their size
+    limits. Disk hits are promoted into memory.
+
+    Each worker only sees its own inserts, so the disk size it tracks falls
+    behind when several workers share the file; it is re-read with COUNT(*)
+    every `recount_every` new keys, which keeps the file within about
+    `max_disk_entries` plus that many entries per worker.
+
+    `get()` and `set()` block on SQLite; code on the event loop uses `aget()`
+    and `aset()`, which run the disk tier on a worker thread.
+    """
+
+    def __init__(self, path: str | None = None, max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100000, ttl: float = 86400.0, recount_every: int = 1000):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.recount_every = recount_every
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._inserts_since_count = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+            self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),))
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT answer, expires_at FROM answers WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, answer: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, answer)
+            if self._db is None:
+                return
+            # INSERT OR REPLACE reports one row either way, so look first to count only new keys.
+            existed = self._db.execute("SELECT 1 FROM answers WHERE key = ?", (key,)).fetchone() is not None
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, answer, expires_at, now)
+            )
+            if not existed:
+                self._disk_count += 1
+                self._inserts_since_count += 1
+                if self._inserts_since_count >= self.recount_every:
+                    self._disk_count = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                    self._inserts_since_count = 0
+            if self._disk_count > self.max_disk_entries:
+                # Trim back to 90% so eviction runs in batches rather than on every insert.
+                target = int(self.max_disk_entries * 0.9)
+                before = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+                self._db.execute(
+                    "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access LIMIT "
+                    "max(0, (SELECT COUNT(*) FROM answers) - ?))", (target,)
+                )
+                self._disk_count = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                self._inserts_since_count = 0
+                self.stats["disk_evictions"] += before - self._disk_count
+
+    async def aget(self, key: str) -> str | None:
+        entry = self._memory.get(key)
+        if self._db is None or (entry is not None and entry[0] > time.time()):
+            # Served from memory: nothing to wait for.
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, answer: str):
+        if self._db is None:
+            self.set(key, answer)
+        else:
+            await asyncio.to_thread(self.set, key, answer)
+
+    def _remember(self, key: str, expires_at: float, answer: str):
+        self._memory[key] = (expires_at, answer)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_count if self._db is not None else 0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,118 @@
+# chat_history.py
+import asyncio
+import random
+import uuid
+
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind sink for chat history entries.
+
+    Endpoints enqueue entries and return at once; a background worker drains
+    the queue into batched `append_chat_history()` calls on the storage
+    backend, committing when `batch_size` entries are waiting or
+    `flush_interval` seconds after the first one arrived. The queue is
+    bounded, so if storage falls behind callers wait for room instead of
+    memory growing. Failed commits are retried with exponential backoff and
+    full jitter; entry ids are assigned on enqueue, so a retried commit
+    overwrites rather than duplicates. `stop()` flushes
+    whatever is still queued.
+    """
+
+    def __init__(self, app_id: str, batch_size: int = FIRESTORE_BATCH_LIMIT, flush_interval: float = 1.0,
+                 max_queue_size: int = 10000, max_retries: int = 5, retry_base_delay: float = 0.5):
+        self.app_id = app_id
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.storage = None
+        self.stats = {"queued": 0, "written": 0, "commits": 0, "retries": 0, "dropped": 0}
+        self._queue: asyncio.Queue | None = None
+        # Set by save() once a full batch is waiting, so the worker can stop waiting early.
+        self._batch_full: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self, storage):
+        """Binds the storage backend and starts the worker on the running event loop."""
+        self.storage = storage
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._batch_full = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"WARNING: Chat history flush timed out; {self._queue.qsize()} entries were not written.")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def save(self, user_id: str, query: str, response: dict, api_endpoint: str):
+        """Queues one entry, waiting only if the queue is full."""
+        entry = {
+            "user_id": user_id,
+            "query": query,
+            "response": response,
+            "api_endpoint": api_endpoint
+        }
+        # The backend stamps the timestamp when the batch is written.
+        await self._queue.put((uuid.uuid4().hex, entry))
+        self.stats["queued"] += 1
+        # The worker already holds the first entry of its batch.
+        if self._queue.qsize() >= self.batch_size - 1:
+            self._batch_full.set()
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        # The rest is taken with get_nowait(): a get() cancelled by a timeout
+        # can lose the entry it had already taken off the queue.
+        if self._queue.qsize() < self.batch_size - 1:
+            self._batch_full.clear()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _commit(self, entries: list):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.storage.append_chat_history(self.app_id, entries)
+                self.stats["commits"] += 1
+                self.stats["written"] += len(entries)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.stats["dropped"] += len(entries)
+                    print(f"Error saving {len(entries)} chat history entries to {self.storage.name} after {attempt + 1} attempts: {e}")
+                    return
+                self.stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+
+    async def _run(self):
+        while True:
+            entries = await self._next_batch()
+            try:
+                await self._commit(entries)
+            finally:
+                for _ in entries:
+                    self._queue.task_done()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": self._queue.qsize() if self._queue is not None else 0}
@@ -0,0 +1,113 @@
+# context_builder.py
+from knowledge_base import KnowledgeRecord
+from prompts import build_rag_prompt
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+NO_CONTEXT = "No specific information found in the knowledge base."
+
+
+class ContextBuilder:
+    """
+    Packs retrieved knowledge-base records into a fixed token budget.
+
+    The budget is whatever `n_ctx` leaves after the prompt template, the user
+    question, `reserve_tokens` for the answer and a small safety margin,
+    optionally capped by `max_context_tokens`. Lines are admitted by section
+    priority first and retrieval rank second: the identifying lines of every
+    record, then each record's most useful field, and so on, so lower-priority
+    fields of lower-ranked records are the first to be cut. Packing stops at
+    the first line that no longer fits, which is truncated rather than dropped
+    when enough room is left.
+
+    `count_tokens(texts)` must be an async callable returning the model's token
+    count for each text. Lines are counted on their own, which slightly
+    over-estimates the joined context, and the counts are cached since the
+    knowledge base never changes.
+    """
+
+    def __init__(self, count_tokens, n_ctx: int, reserve_tokens: int,
+                 max_context_tokens: int | None = None, safety_margin: int = 16, min_truncated_tokens: int = 16):
+        self.count_tokens = count_tokens
+        self.n_ctx = n_ctx
+        self.reserve_tokens = reserve_tokens
+        self.max_context_tokens = max_context_tokens
+        self.safety_margin = safety_margin
+        self.min_truncated_tokens = min_truncated_tokens
+        self._template_tokens: int | None = None
+        self._separator_tokens = 0
+        self._line_tokens: dict[str, int] = {}
+
+    async def budget(self, question: str) -> int:
+        """Tokens available for the context block when answering `question`."""
+        texts = [question]
+        if self._template_tokens is None:
+            texts += [build_rag_prompt("", ""), CONTEXT_SEPARATOR]
+        counts = await self.count_tokens(texts)
+        if self._template_tokens is None:
+            self._template_tokens, self._separator_tokens = counts[1], counts[2]
+        available = self.n_ctx - self.reserve_tokens - self.safety_margin - self._template_tokens - counts[0]
+        if self.max_context_tokens is not None:
+            available = min(available, self.max_context_tokens)
+        return max(available, 0)
+
+    async def _count_lines(self, records: list[KnowledgeRecord]):
+        missing = list({line for record in records for _priority, line in record.sections} - self._line_tokens.keys())
+        if missing:
+            # One tokenizer call per request at most, and none once the hot records are cached.
+            for line, count in zip(missing, await self.count_tokens(missing)):
+                self._line_tokens[line] = count
+
+    async def _truncate(self, line: str, tokens: int, room: int) -> tuple[str, int]:
+        """Shortens `line` to fit in `room` tokens, or returns ("", 0) if it can't be done usefully."""
+        label, _, value = line.partition(": ")
+        ratio = room / tokens
+        for _ in range(3):
+            keep = int(len(value) * ratio)
+            truncated = f"{label}: {value[:keep].rstrip(' ,;')}..."
+            count = (await self.count_tokens([truncated]))[0] + 1
+            if count <= room:
+                return truncated, count
+            ratio *= 0.8
+        return "", 0
+
+    async def build(self, scored_docs, question: str) -> str:
+        """Renders the context block for the (record, score) pairs in `scored_docs`, best first."""
+        records = [record for record, _score in scored_docs]
+        if not records:
+            return NO_CONTEXT
+
+        room = await self.budget(question)
+        await self._count_lines(records)
+
+        # Each admitted line costs its own tokens plus one for the newline.
+        chosen: dict[int, dict[int, str]] = {}
+        for rank, record in enumerate(records):
+            header = [line for priority, line in record.sections if priority == 0]
+            cost = sum(self._line_tokens[line] + 1 for line in header) + (self._separator_tokens if chosen else 0)
+            if cost <= room:
+                chosen[rank] = {i: line for i, (priority, line) in enumerate(record.sections) if priority == 0}
+                room -= cost
+
+        candidates = sorted(
+            (priority, rank, i, line)
+            for rank in chosen
+            for i, (priority, line) in enumerate(records[rank].sections) if priority > 0
+        )
+        for _priority, rank, i, line in candidates:
+            cost = self._line_tokens[line] + 1
+            if cost <= room:
+                chosen[rank][i] = line
+                room -= cost
+            else:
+                if room >= self.min_truncated_tokens:
+                    truncated, cost = await self._truncate(line, cost, room)
+                    if truncated:
+                        chosen[rank][i] = truncated
+                # Stop here so a lower-priority line never takes the place of a higher-priority one.
+                break
+
+        if not chosen:
+            return NO_CONTEXT
+        return CONTEXT_SEPARATOR.join(
+            "\n".join(lines[i] for i in sorted(lines)) for _rank, lines in sorted(chosen.items())
+        )
@@ -0,0 +1,186 @@
+# firestore_storage.py
+import asyncio
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.async_client import AsyncClient
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from product_import import ImportReport
+from storage import ProductNotFound, StorageBackend
+
+# gRPC status codes worth another attempt: DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED,
+# ABORTED, INTERNAL and UNAVAILABLE. Anything else is reported against the row.
+RETRYABLE_CODES = frozenset({4, 8, 10, 13, 14})
+
+
+class FirestoreProductImporter(ImportReport):
+    """
+    Writes validated product rows through a Firestore BulkWriter.
+
+    BulkWriter batches the writes, sends batches in parallel and throttles
+    itself with the 500/50/5 ramp-up (starting at `initial_ops_per_second`
+    and growing by half every five minutes up to `max_ops_per_second`). Its
+    calls block, and the throttle sleeps on the calling thread, so every call
+    is made from a worker thread; the importer awaits each chunk, which also
+    slows reading the upload down to the rate Firestore accepts.
+
+    Writes that fail with a retryable status are retried up to
+    `max_attempts` times; other failures, and retries that run out, are
+    reported against the row that produced them.
+    """
+
+    def __init__(self, db: AsyncClient, create_only: bool = False, initial_ops_per_second: int = 500,
+                 max_ops_per_second: int = 10000, max_attempts: int = 5):
+        super().__init__()
+        self.create_only = create_only
+        self.max_attempts = max_attempts
+        self._collection = db.collection('products')
+        self._rows: dict[str, tuple[int, str]] = {}
+        self._writer = db.bulk_writer(BulkWriterOptions(
+            initial_ops_per_second=initial_ops_per_second,
+            max_ops_per_second=max_ops_per_second,
+            mode=SendMode.parallel,
+        ))
+        self._writer.on_write_result(self._on_write_result)
+        self._writer.on_write_error(self._on_write_error)
+
+    def _on_write_result(self, reference, _result, _writer):
+        with self._lock:
+            self._rows.pop(reference._document_path, None)
+        self.record_written()
+
+    def _on_write_error(self, failure, _writer) -> bool:
+        if failure.code in RETRYABLE_CODES and failure.attempts < self.max_attempts:
+            return True
+        reference = failure.operation.reference
+        with self._lock:
+            row_number, product_id = self._rows.pop(reference._document_path, (0, reference.id))
+        self.record_error(row_number, product_id, f"Firestore write failed ({failure.code}): {failure.message}")
+        return False
+
+    def _enqueue(self, rows: list):
+        for row_number, product_id, data in rows:
+            reference = self._collection.document(product_id)
+            with self._lock:
+                self._rows[reference._document_path] = (row_number, product_id)
+            data = {**data, "created_at": firestore.SERVER_TIMESTAMP, "updated_at": firestore.SERVER_TIMESTAMP}
+            if self.create_only:
+                self._writer.create(reference, data)
+            else:
+                self._writer.set(reference, data)
+
+    async def write(self, rows: list):
+        """Queues (row number, product id, data) triples for writing."""
+        await asyncio.get_running_loop().run_in_executor(None, self._enqueue, rows)
+
+    async def close(self):
+        """Waits for every queued write (and its retries) to finish."""
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.close)
+
+
+class FirestoreStorage(StorageBackend):
+    """
+    Storage on Cloud Firestore: products in the top-level `products`
+    collection and chat history under
+    artifacts/{app_id}/users/{user_id}/chat_history.
+
+    Mutations take one round trip: create() and update() fail on an existing
+    or missing document respectively, and deletes carry an exists
+    precondition. Snapshot listeners only exist on the synchronous client, so
+    `watch_products()` uses `listener_client` (by default the Firebase Admin
+    app's `firestore.client()`).
+    """
+
+    name = "firestore"
+
+    def __init__(self, db: AsyncClient, listener_client=None):
+        self.db = db
+        self.listener_client = listener_client
+
+    def _products(self):
+        return self.db.collection('products')
+
+    async def create_product(self, product_id: str, data: dict) -> dict:
+        data = {**data, "created_at": firestore.SERVER_TIMESTAMP, "updated_at": firestore.SERVER_TIMESTAMP}
+        # create() fails instead of overwriting if the id is somehow taken.
+        write_result = await self._products().document(product_id).create(data)
+        # SERVER_TIMESTAMP resolves to the commit time, so the stored document is known without reading it back.
+        data["created_at"] = write_result.update_time
+        data["updated_at"] = write_result.update_time
+        return data
+
+    async def get_product(self, product_id: str) -> dict | None:
+        doc = await self._products().document(product_id).get()
+        if not doc.exists:
+            return None
+        return {"id": doc.id, **doc.to_dict()}
+
+    async def update_product(self, product_id: str, data: dict):
+        try:
+            # update() only succeeds on an existing document, so it doubles as the existence check.
+            write_result = await self._products().document(product_id).update(
+                {**data, "updated_at": firestore.SERVER_TIMESTAMP}
+            )
+        except NotFound:
+            raise ProductNotFound(product_id)
+        return write_result.update_time
+
+    async def delete_product(self, product_id: str):
+        try:
+            # A single conditional delete: the exists precondition makes a missing product fail with NotFound.
+            await self._products().document(product_id).delete(option=self.db.write_option(exists=True))
+        except NotFound:
+            raise ProductNotFound(product_id)
+
+    def products_page_query(self, limit: int, start_after: str | None = None, fields: list[str] | None = None):
+        """One page of products in document-id order, resuming after the `start_after` id."""
+        document_id = FieldPath.document_id()
+        query = self._products().order_by(document_id)
+        if fields is not None:
+            query = query.select(fields)
+        if start_after:
+            query = query.start_after({document_id: start_after})
+        return query.limit(limit)
+
+    async def list_products(self, limit: int, start_after: str | None = None, fields: list[str] | None = None) -> list[dict]:
+        return [{"id": doc.id, **doc.to_dict()} async for doc in self.products_page_query(limit, start_after, fields).stream()]
+
+    async def find_products_by_name(self, name: str, include_out_of_stock: bool = False) -> list[dict]:
+        query = self._products().where('name', '==', name)
+        if not include_out_of_stock:
+            query = query.where('in_stock', '==', True)
+        return [{"id": doc.id, **doc.to_dict()} async for doc in query.stream()]
+
+    async def search_products_by_prefix(self, prefix: str, include_out_of_stock: bool = False) -> list[dict]:
+        # The \uf8ff character is a very high code point in Unicode.
+        # Appending it to the search term creates an upper bound for the query,
+        # effectively matching all strings that start with the prefix.
+        query = self._products().where('name', '>=', prefix).where('name', '<=', prefix + u'\uf8ff')
+        if not include_out_of_stock:
+            query = query.where('in_stock', '==', True)
+        return [{"id": doc.id, **doc.to_dict()} async for doc in query.stream()]
+
+    def product_importer(self, create_only: bool = False) -> FirestoreProductImporter:
+        return FirestoreProductImporter(self.db, create_only=create_only)
+
+    def watch_products(self, on_changes):
+        def on_snapshot(_documents, changes, _read_time):
+            on_changes([
+                (change.document.id, None if change.type.name == "REMOVED" else change.document.to_dict())
+                for change in changes
+            ])
+        client = self.listener_client if self.listener_client is not None else firestore.client()
+        return client.collection('products').on_snapshot(on_snapshot)
+
+    def chat_history(self, app_id: str, user_id: str):
+        return self.db.collection('artifacts').document(app_id).collection('users').document(user_id).collection('chat_history')
+
+    async def append_chat_history(self, app_id: str, entries: list):
+        # A WriteBatch can't be committed twice, so each call builds a fresh one.
+        write_batch = self.db.batch()
+        for entry_id, entry in entries:
+            document_ref = self.chat_history(app_id, entry["user_id"]).document(entry_id)
+            write_batch.set(document_ref, {**entry, "timestamp": firestore.SERVER_TIMESTAMP})
+        await write_batch.commit()
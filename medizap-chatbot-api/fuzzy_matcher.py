@@ -0,0 +1,95 @@
+# fuzzy_matcher.py
+import re
+from collections import Counter, defaultdict
+
+WORD_RE = re.compile(r'[a-z]{3,}')
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    """All strings reachable from `word` by removing up to `max_distance` characters."""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w)) if len(w) > 1}
+        results |= frontier
+    return results
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance between `a` and `b`, capped at `limit + 1`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class SymSpellIndex:
+    """
+    Symmetric-delete spelling corrector over a canonical medical vocabulary.
+
+    Every vocabulary word is stored under each string obtained by deleting up
+    to `max_distance` characters from it. A misspelled keyword generates its
+    own deletes and looks them up, so finding candidates costs a handful of
+    dict lookups regardless of vocabulary size; candidates are then confirmed
+    with a bounded edit distance and ranked by distance, then frequency.
+    """
+
+    def __init__(self, terms, max_distance: int = 2):
+        self.max_distance = max_distance
+        self.frequencies: Counter = Counter()
+        for term in terms:
+            if isinstance(term, str):
+                self.frequencies.update(WORD_RE.findall(term.lower()))
+
+        self._deletes: dict[str, list[str]] = defaultdict(list)
+        for word in self.frequencies:
+            for deleted in _deletes(word, max_distance):
+                self._deletes[deleted].append(word)
+        self._deletes = dict(self._deletes)
+        self._cache: dict[str, str | None] = {}
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def _limit(self, word: str) -> int:
+        # Short words get less slack so "flu" doesn't turn into "flue" or "fly".
+        return 1 if len(word) <= 5 else self.max_distance
+
+    def correct(self, word: str) -> str | None:
+        """Returns the closest canonical word for `word`, or None if nothing is close enough."""
+        word = word.lower()
+        if word in self.frequencies:
+            return word
+        if word in self._cache:
+            return self._cache[word]
+
+        limit = self._limit(word)
+        best, best_key = None, None
+        seen = set()
+        for deleted in _deletes(word, limit):
+            for candidate in self._deletes.get(deleted, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = _edit_distance(word, candidate, limit)
+                if distance > limit:
+                    continue
+                key = (distance, -self.frequencies[candidate], candidate)
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+
+        if len(self._cache) >= 10000:
+            self._cache.clear()
+        self._cache[word] = best
+        return best
@@ -0,0 +1,328 @@
+# inference.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from llama_cpp import StoppingCriteriaList
+
+
+def generation_rates(stats: dict) -> dict:
+    """
+    Adds throughput and, when a speculative drafter is in use, the accepted
+    draft-token rate to raw generation counters.
+
+    Every drafter call comes with one token the model samples itself, so the
+    drafted tokens that were accepted are roughly the completion tokens minus
+    the drafter calls.
+    """
+    rates = dict(stats)
+    seconds = stats.get("generation_seconds", 0.0)
+    rates["tokens_per_second"] = stats.get("completion_tokens", 0) / seconds if seconds else 0.0
+    if stats.get("drafted_tokens"):
+        accepted = max(stats["completion_tokens"] - stats["draft_calls"], 0)
+        rates["accepted_draft_tokens"] = accepted
+        rates["draft_acceptance_rate"] = min(accepted / stats["drafted_tokens"], 1.0)
+    return rates
+
+
+class _Job:
+    """
+    One generation, shared by every request that asked for the same prompt.
+
+    Text chunks are kept in `chunks` and fanned out to each subscriber queue
+    (followed by a None sentinel), so a streaming request that joins late
+    replays what was already generated. The model is stopped early once the
+    last waiter has gone.
+    """
+    __slots__ = ("key", "prompt", "kwargs", "loop", "future", "cancelled", "stream",
+                 "chunks", "subscribers", "finished", "waiters")
+
+    def __init__(self, key, prompt: str, kwargs: dict, loop: asyncio.AbstractEventLoop, stream: bool = False):
+        self.key = key
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.loop = loop
+        self.future = loop.create_future()
+        # Set when every caller gives up, so a running generation stops at the next token.
+        self.cancelled = threading.Event()
+        self.stream = stream
+        self.chunks: list[str] = []
+        self.subscribers: list[asyncio.Queue] = []
+        self.finished = False
+        self.waiters = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait(chunk)
+        if self.finished:
+            queue.put_nowait(None)
+        self.subscribers.append(queue)
+        return queue
+
+    def publish(self, text: str):
+        self.chunks.append(text)
+        for queue in self.subscribers:
+            queue.put_nowait(text)
+
+    def finish(self):
+        self.finished = True
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+
+class TokenStream:
+    """
+    Async iterator over a streamed generation's text chunks that owns what
+    keeps the generation going (a queue slot, a model-server connection).
+
+    `on_close` runs exactly once: when iteration ends or fails, on
+    `aclose()`, or when the stream is garbage collected without being
+    closed. A client that disconnects before the first chunk is read
+    therefore still cancels its generation.
+    """
+
+    def __init__(self, chunks, on_close, loop: asyncio.AbstractEventLoop):
+        self._chunks = chunks
+        self._on_close = on_close
+        self._loop = loop
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            self._close()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._chunks.aclose()
+        finally:
+            self._close()
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            self._on_close()
+
+    def __del__(self):
+        if not self._closed and not self._loop.is_closed():
+            # Finalizers can run on any thread; the cleanup touches state owned by the loop.
+            self._loop.call_soon_threadsafe(self._close)
+
+
+class InferenceScheduler:
+    """
+    Runs every call on the shared `Llama` instance off the event loop.
+
+    A single executor thread owns the model, so generations never overlap and
+    the loop stays free for the rest of the API. Requests wait in a bounded
+    asyncio queue: when it is full new requests are rejected immediately with
+    429, and a request that exceeds its timeout (queue wait included) gets 504
+    while its generation is stopped early. Streaming requests go through the
+    same queue and hand their chunks back to the loop as they are produced.
+
+    Identical requests (same prompt and generation settings) arriving while a
+    generation is queued or running are coalesced onto it: only one generation
+    runs and every waiter, streaming or not, receives the shared result.
+
+    When a `prompt_prefix` is given, it is evaluated once when the worker
+    starts. llama.cpp keeps the tokens of the last prompt in its KV cache and
+    only evaluates what follows the longest match, so every prompt that starts
+    with the prefix (including the first) skips straight to the context and
+    the user question.
+    """
+
+    def __init__(self, max_queue_size: int = 8, timeout: float = 120.0):
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.model = None
+        self.prompt_prefix: str | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-inference")
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._inflight: dict = {}
+        self.stats = {"generations": 0, "coalesced": 0, "completion_tokens": 0, "generation_seconds": 0.0}
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None and self._worker is not None and not self._worker.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def raw_stats(self) -> dict:
+        """Generation counters, including the speculative drafter's when the model has one."""
+        drafter = getattr(self.model, "draft_model", None)
+        return {**self.stats, **getattr(drafter, "stats", {})}
+
+    def snapshot(self) -> dict:
+        return generation_rates(self.raw_stats())
+
+    def start(self, model, prompt_prefix: str | None = None):
+        """Binds the loaded model and starts the worker on the running event loop."""
+        self.model = model
+        self.prompt_prefix = prompt_prefix
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def count_tokens(self, texts: list[str]) -> list[int]:
+        """Number of model tokens in each text, without the BOS token."""
+        if self.model is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The local AI model is not available. Please try again later."
+            )
+        # Tokenizing only reads the vocabulary, so it is safe next to a running generation.
+        return [len(self.model.tokenize(text.encode("utf-8"), add_bos=False)) for text in texts]
+
+    def _acquire(self, prompt: str, kwargs: dict, stream: bool = False) -> _Job:
+        if not self.ready:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The local AI model is not available. Please try again later."
+            )
+
+        key = (prompt, repr(sorted(kwargs.items())))
+        job = self._inflight.get(key)
+        if job is not None and not job.cancelled.is_set():
+            job.waiters += 1
+            self.stats["coalesced"] += 1
+            return job
+
+        job = _Job(key, prompt, kwargs, asyncio.get_running_loop(), stream=stream)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="The AI assistant is busy. Please try again in a moment.",
+                headers={"Retry-After": "5"}
+            )
+        job.waiters = 1
+        self._inflight[key] = job
+        return job
+
+    def is_inflight(self, prompt: str, **kwargs) -> bool:
+        return (prompt, repr(sorted(kwargs.items()))) in self._inflight
+
+    def _release(self, job: _Job):
+        job.waiters -= 1
+        if job.waiters <= 0 and not job.future.done():
+            # Nobody is waiting any more; don't spend the model on an unread answer.
+            job.cancelled.set()
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+
+    async def generate(self, prompt: str, **kwargs) -> dict:
+        """Queues (or joins) a completion request and waits for its result."""
+        job = self._acquire(prompt, kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="The AI assistant took too long to respond. Please try again."
+            )
+        finally:
+            self._release(job)
+
+    async def stream(self, prompt: str, **kwargs) -> TokenStream:
+        """
+        Queues (or joins) a streaming completion request and returns a
+        TokenStream of text chunks. Admission errors (429/503) are raised here,
+        before any chunk is produced, so callers can still answer with a plain error.
+        """
+        job = self._acquire(prompt, kwargs, stream=True)
+        return TokenStream(self._iter_tokens(job, job.subscribe()), lambda: self._release(job), job.loop)
+
+    async def _iter_tokens(self, job: _Job, tokens: asyncio.Queue):
+        deadline = job.loop.time() + self.timeout
+        while True:
+            try:
+                token = await asyncio.wait_for(tokens.get(), timeout=max(deadline - job.loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    detail="The AI assistant took too long to respond. Please try again."
+                )
+            if token is None:
+                break
+            yield token
+        # Surfaces any error raised by the model after the last chunk.
+        await asyncio.shield(job.future)
+
+    def _prime_prefix(self):
+        tokens = self.model.tokenize(self.prompt_prefix.encode("utf-8"))
+        self.model.reset()
+        self.model.eval(tokens)
+        print(f"Cached KV state for the {len(tokens)}-token system prompt prefix.")
+
+    def _call_model(self, job: _Job):
+        stopping_criteria = StoppingCriteriaList([lambda input_ids, logits: job.cancelled.is_set()])
+        if not job.stream:
+            return self.model(job.prompt, stopping_criteria=stopping_criteria, **job.kwargs)
+
+        parts = []
+        completion_tokens = 0
+        for chunk in self.model(job.prompt, stopping_criteria=stopping_criteria, stream=True, **job.kwargs):
+            # Each streamed chunk is one sampled token, even when it holds no complete character yet.
+            completion_tokens += 1
+            text = chunk['choices'][0]['text']
+            if text:
+                parts.append(text)
+                job.loop.call_soon_threadsafe(job.publish, text)
+        return {'choices': [{'text': ''.join(parts)}], 'usage': {'completion_tokens': completion_tokens}}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self.prompt_prefix:
+            try:
+                await loop.run_in_executor(self._executor, self._prime_prefix)
+            except Exception as e:
+                print(f"ERROR: Failed to cache the prompt prefix KV state. The first prompt will be evaluated in full. Error: {e}")
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.cancelled.is_set() or job.future.done():
+                    job.finish()
+                    continue
+                self.stats["generations"] += 1
+                started = time.perf_counter()
+                try:
+                    result = await loop.run_in_executor(self._executor, self._call_model, job)
+                except Exception as e:
+                    if not job.future.done() and not job.cancelled.is_set():
+                        job.future.set_exception(e)
+                        # Mark it retrieved; waiters that already left won't see it.
+                        job.future.exception()
+                else:
+                    self.stats["completion_tokens"] += result.get('usage', {}).get('completion_tokens', 0)
+                    self.stats["generation_seconds"] += time.perf_counter() - started
+                    if not job.stream:
+                        # Streaming waiters that joined a non-streaming generation get it in one chunk.
+                        job.publish(result['choices'][0]['text'])
+                    if not job.future.done():
+                        job.future.set_result(result)
+                job.finish()
+            finally:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+                self._queue.task_done()
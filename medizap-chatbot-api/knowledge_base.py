@@ -0,0 +1,111 @@
+# knowledge_base.py
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class KnowledgeRecord:
+    """
+    Normalized, immutable view of one disease or drug knowledge-base entry.
+
+    `fields` holds the pre-lowercased searchable text as (field, text) pairs in
+    scoring order, and `context` is the block rendered into the RAG prompt.
+    `sections` holds the lines of `context` as (priority, line) pairs in display
+    order; priority 0 lines identify the record and are never dropped, higher
+    numbers are dropped first when the prompt runs out of room. `attributes`
+    keeps the original-case values of each structured field as
+    (attribute, items) pairs for answers that are templated rather than generated.
+    """
+    doc_type: str
+    title: str
+    fields: tuple[tuple[str, str], ...]
+    context: str
+    sections: tuple[tuple[int, str], ...] = ()
+    attributes: tuple[tuple[str, tuple[str, ...]], ...] = ()
+
+    def attribute(self, name: str) -> tuple[str, ...]:
+        for attribute, items in self.attributes:
+            if attribute == name:
+                return items
+        return ()
+
+
+def _render(sections: tuple[tuple[int, str], ...]) -> str:
+    return "\n".join(line for _priority, line in sections)
+
+
+def list_items(data, key_name) -> tuple[str, ...]:
+    if not isinstance(data, list): return ()
+    # Some keys in data-drug.json carry a trailing space (e.g. "contra_indication ").
+    values = [item.get(key_name) or item.get(key_name.strip() + ' ') for item in data]
+    return tuple(filter(None, values))
+
+
+def format_list(data, key_name):
+    return ', '.join(list_items(data, key_name)) or "N/A"
+
+
+def _lower(value) -> str:
+    return value.lower() if isinstance(value, str) else ''
+
+
+def normalize_disease(doc: dict) -> KnowledgeRecord:
+    symptoms = doc.get('symptoms', [])
+    fields = [('disease', _lower(doc.get('disease', '')))]
+    # Every symptom is scored on its own, so each one gets its own field slot.
+    fields.extend(('symptom', _lower(s)) for s in symptoms)
+    sections = (
+        (0, "Type: Disease Information"),
+        (0, f"Disease: {doc.get('disease', 'N/A')}"),
+        (2, f"Description: {doc.get('description', 'N/A')}"),
+        (1, f"Symptoms: {', '.join(symptoms)}"),
+        (3, f"Common Medicines: {', '.join(doc.get('medicines', []))}"),
+    )
+    attributes = (
+        ('description', (doc['description'],) if doc.get('description') else ()),
+        ('symptoms', tuple(symptoms)),
+        ('medicines', tuple(doc.get('medicines', []))),
+    )
+    return KnowledgeRecord('disease', doc.get('disease', ''), tuple(fields), _render(sections), sections, attributes)
+
+
+def normalize_drug(doc: dict) -> KnowledgeRecord:
+    doses = doc.get('dose', [])
+    fields = (
+        ('name', _lower(doc.get('name', ''))),
+        ('dose', ' '.join(f"{_lower(d.get('profil', ''))} {_lower(d.get('dose', ''))}" for d in doses)),
+        ('indication', _lower(doc.get('indication', ''))),
+        ('composition', ' '.join(_lower(c.get('composition', '')) for c in doc.get('composition', []))),
+        ('side_effect', ' '.join(_lower(s.get('side_effect', '')) for s in doc.get('side_effect', []))),
+        ('category', _lower(doc.get('category', ''))),
+    )
+    dose_str = ", ".join([f"{d.get('profil', 'General')}: {d.get('dose', 'N/A')}" for d in doses])
+    sections = (
+        (0, "Type: Drug Information"),
+        (0, f"Drug Name: {doc.get('name', 'N/A')}"),
+        (1, f"Indication: {doc.get('indication', 'N/A')}"),
+        (4, f"Composition: {format_list(doc.get('composition', []), 'composition')}"),
+        (3, f"Side Effects: {format_list(doc.get('side_effect', []), 'side_effect')}"),
+        (2, f"Dosage: {dose_str}"),
+    )
+    attributes = (
+        ('indication', (doc['indication'],) if doc.get('indication') else ()),
+        ('dose', tuple(f"{d.get('profil', 'General')}: {d.get('dose', 'N/A')}" for d in doses)),
+        ('side_effect', list_items(doc.get('side_effect', []), 'side_effect')),
+        ('contra_indication', list_items(doc.get('contra_indication', []), 'contra_indication')),
+        ('drug_interaction', list_items(doc.get('drug_interaction', []), 'drug_interaction')),
+        ('rule', list_items(doc.get('rule', []), 'usage_rule')),
+        ('usage_periode', list_items(doc.get('usage_periode', []), 'usage_periode')),
+        ('composition', tuple(
+            ' '.join(filter(None, (c.get('composition'), c.get('amount'), c.get('unit'))))
+            for c in doc.get('composition', []) if c.get('composition')
+        )),
+    )
+    return KnowledgeRecord('drug', doc.get('name', ''), fields, _render(sections), sections, attributes)
+
+
+def normalize_diseases(docs: list[dict]) -> tuple[KnowledgeRecord, ...]:
+    return tuple(normalize_disease(doc) for doc in docs)
+
+
+def normalize_drugs(docs: list[dict]) -> tuple[KnowledgeRecord, ...]:
+    return tuple(normalize_drug(doc) for doc in docs)
@@ -7,7 +7,7 @@ from PIL import Image
 import io
 import requests
 import json
-from llama_cpp import Llama
+import asyncio
 
 
 from dotenv import load_dotenv
@@ -21,12 +21,29 @@ from google.cloud.firestore_v1.async_client import AsyncClient
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, Request, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 
 import products 
 from products import router as products_router 
+from answer_cache import AnswerCache, make_cache_key
+from chat_history import ChatHistoryWriter
+from context_builder import ContextBuilder
+from firestore_storage import FirestoreStorage
+from fuzzy_matcher import SymSpellIndex
+from inference import InferenceScheduler
+from knowledge_base import normalize_diseases, normalize_drugs
+from model_manager import ModelManager
+from model_server import RemoteInferenceClient
+from product_catalog import ProductCatalog
+from prompts import LLM_GENERATION_KWARGS, PROMPT_PREFIX, build_rag_prompt
+from query_router import QueryRouter
+from retrieval import BM25Index, extract_keywords
+from sqlite_storage import SQLiteStorage
+from symptom_classifier import SymptomClassifier
+from token_verifier import TokenVerifier
+from vector_store import DEFAULT_STORE_PATH, VectorStore, reciprocal_rank_fusion
 
 origins = [
     "http://localhost:3000",
@@ -46,6 +63,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[products.NEXT_CURSOR_HEADER],
 )
 
 app.include_router(products_router, prefix="/api/v1")
@@ -58,27 +76,69 @@ CSV_FILE_NAME = "book1.csv"
 APP_ID = os.environ.get("APP_ID", "default-medizap-app")
 NEWS_API_KEY = os.environ.get("NEWS_API_KEY", "4f30447ac575407ab4ddc687060d8677")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
+# "keyword" (BM25 only), "semantic" (embeddings only) or "hybrid" (both, fused).
+RAG_RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "keyword").lower()
+EMBEDDING_MODEL_PATH = os.environ.get("EMBEDDING_MODEL_PATH", "")
+VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", DEFAULT_STORE_PATH)
+# When set, the LLM is served by a separate model_server.py process on this Unix socket
+# instead of being loaded into every API worker.
+LLM_SERVER_SOCKET = os.environ.get("LLM_SERVER_SOCKET", "")
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "8"))
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "120"))
+# Set ANSWER_CACHE_PATH to an empty string to keep the answer cache in memory only.
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", os.path.join(os.path.dirname(__file__), "answer_cache.sqlite3"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "100000"))
+# Optional cap on the tokens spent on retrieved context; by default it gets
+# whatever n_ctx leaves after the prompt, the question and the answer.
+RAG_CONTEXT_MAX_TOKENS = int(os.environ.get("RAG_CONTEXT_MAX_TOKENS", "0")) or None
+# Without a trained classifier at SYMPTOM_CLASSIFIER_PATH, diseases are ranked by
+# similarity to their knowledge-base symptoms in the shipped feature space.
+SYMPTOM_FEATURES_PATH = os.environ.get("SYMPTOM_FEATURES_PATH", os.path.join(os.path.dirname(__file__), "models", "trained_disease_model_features.pkl"))
+SYMPTOM_CLASSIFIER_PATH = os.environ.get("SYMPTOM_CLASSIFIER_PATH", os.path.join(os.path.dirname(__file__), "models", "trained_disease_model.pkl"))
+# Also fuse the classifier's candidate diseases into RAG retrieval (off: retrieval uses RAG_RETRIEVAL_MODE alone).
+SYMPTOM_CLASSIFIER_RETRIEVAL = os.environ.get("SYMPTOM_CLASSIFIER_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", "1000"))
+CHAT_HISTORY_FLUSH_SECONDS = float(os.environ.get("CHAT_HISTORY_FLUSH_SECONDS", "1.0"))
+CHAT_HISTORY_QUEUE_SIZE = int(os.environ.get("CHAT_HISTORY_QUEUE_SIZE", "10000"))
+# Serve product reads from an in-memory copy of the collection kept current by a snapshot listener.
+PRODUCT_CATALOG_REPLICA = os.environ.get("PRODUCT_CATALOG_REPLICA", "false").lower() in ("1", "true", "yes")
+# Where products and chat history live: "firestore" (needs the Firebase key) or "sqlite" (a local file).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore").lower()
+SQLITE_STORAGE_PATH = os.environ.get("SQLITE_STORAGE_PATH", os.path.join(os.path.dirname(__file__), "medizap.sqlite3"))
 
 
 llm_model = None
+model_manager = ModelManager.from_env()
+if LLM_SERVER_SOCKET:
+    inference_scheduler = RemoteInferenceClient(LLM_SERVER_SOCKET, timeout=LLM_TIMEOUT_SECONDS)
+else:
+    inference_scheduler = InferenceScheduler(max_queue_size=LLM_QUEUE_SIZE, timeout=LLM_TIMEOUT_SECONDS)
+context_builder = ContextBuilder(
+    inference_scheduler.count_tokens,
+    n_ctx=model_manager.model_kwargs["n_ctx"],
+    reserve_tokens=LLM_GENERATION_KWARGS["max_tokens"],
+    max_context_tokens=RAG_CONTEXT_MAX_TOKENS
+)
 
-disease_knowledge_db = []
-drug_knowledge_db = []
-
-
-
-def get_firestore_client():
-    if db_firestore_client_instance is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Firestore client is not initialized. Please check server setup."
-        )
-    return db_firestore_client_instance
+disease_knowledge_db = ()
+drug_knowledge_db = ()
+knowledge_index = None
+vector_store = None
+spelling_index = None
+query_router = None
+symptom_classifier = None
+disease_records_by_title = {}
+answer_cache = None
+token_verifier = TokenVerifier()
+chat_history_writer = ChatHistoryWriter(APP_ID, flush_interval=CHAT_HISTORY_FLUSH_SECONDS, max_queue_size=CHAT_HISTORY_QUEUE_SIZE)
+product_catalog = ProductCatalog()
+storage_backend = None
 
 
 @app.on_event("startup")
 async def load_medical_data_and_initialize_firebase():
-    global medical_data_df, db_firestore_client_instance, llm_model, disease_knowledge_db, drug_knowledge_db
+    global medical_data_df, db_firestore_client_instance, disease_knowledge_db, drug_knowledge_db, knowledge_index, vector_store, spelling_index, query_router, symptom_classifier, disease_records_by_title, answer_cache, storage_backend
 
     
     print("--- Initializing Firebase Admin SDK ---")
@@ -87,11 +147,9 @@ async def load_medical_data_and_initialize_firebase():
     if not firebase_service_account_key_path:
         print("ERROR: FIREBASE_SERVICE_ACCOUNT_KEY_PATH environment variable not set. Firestore will not be initialized.")
         db_firestore_client_instance = None
-        products.get_firestore_client_dependency = None 
     elif not os.path.exists(firebase_service_account_key_path):
         print(f"ERROR: Firebase service account key file not found at: {firebase_service_account_key_path}. Firestore will not be initialized.")
         db_firestore_client_instance = None
-        products.get_firestore_client_dependency = None 
     else:
         try:
             
@@ -111,17 +169,42 @@ async def load_medical_data_and_initialize_firebase():
             )
             
 
-            products.get_firestore_client_dependency = get_firestore_client 
+            token_verifier.start()
             
             print("Firebase Admin SDK initialized successfully and Firestore client obtained.")
         except Exception as e:
             
             print(f"ERROR: Failed to initialize Firebase Admin SDK from file: {e}. Firestore client will not be available.")
             db_firestore_client_instance = None
-            products.get_firestore_client_dependency = None 
 
     print(f"Firebase client status after startup: {'Initialized' if db_firestore_client_instance else 'NOT Initialized'}")
 
+    print(f"--- Initializing storage backend ({STORAGE_BACKEND}) ---")
+    if STORAGE_BACKEND == "sqlite":
+        try:
+            storage_backend = SQLiteStorage(SQLITE_STORAGE_PATH)
+            print(f"SQLite storage opened at {SQLITE_STORAGE_PATH}.")
+        except Exception as e:
+            print(f"ERROR: Failed to open SQLite storage at {SQLITE_STORAGE_PATH}: {e}. Products and chat history will not be available.")
+            storage_backend = None
+    elif STORAGE_BACKEND == "firestore":
+        storage_backend = FirestoreStorage(db_firestore_client_instance) if db_firestore_client_instance else None
+    else:
+        print(f"ERROR: Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'. Use 'firestore' or 'sqlite'.")
+        storage_backend = None
+    products.storage_backend = storage_backend
+
+    if storage_backend is not None:
+        chat_history_writer.start(storage_backend)
+        if PRODUCT_CATALOG_REPLICA:
+            try:
+                product_catalog.start(storage_backend)
+                products.product_catalog = product_catalog
+                print("Product catalog replica listener started.")
+            except Exception as e:
+                print(f"WARNING: Failed to start the product catalog replica. Product reads will go to {storage_backend.name}. Error: {e}")
+    print(f"Storage backend status after startup: {storage_backend.name + ' ready' if storage_backend else 'NOT available'}")
+
     
     csv_path = os.path.join(os.path.dirname(__file__), CSV_FILE_NAME)
     print(f"--- Application Startup: Loading Medical Data from CSV ---")
@@ -142,68 +225,201 @@ async def load_medical_data_and_initialize_firebase():
         medical_data_df = pd.DataFrame(columns=['Disease', 'Description', 'Symptoms', 'Medicines'])
 
     
-    print("--- Application Startup: Downloading and Loading GGUF Model ---")
+    if LLM_SERVER_SOCKET:
+        print(f"--- Application Startup: Using Model Server at '{LLM_SERVER_SOCKET}' ---")
+        inference_scheduler.start()
+    else:
+        print("--- Application Startup: Loading GGUF Model in the Background ---")
+        model_manager.start(on_ready=on_model_ready)
+
+    
+    print("--- Application Startup: Opening Answer Cache ---")
     try:
-        repo_id = "TheBloke/Wizard-Vicuna-13B-Uncensored-GGUF"
-        filename = "Wizard-Vicuna-13B-Uncensored.Q2_K.gguf"
-        
-        print(f"Downloading and loading model '{filename}' from '{repo_id}'. This may take a while on the first run...")
-        
-        llm_model = Llama.from_pretrained(
-            repo_id=repo_id,
-            filename=filename,
-            n_ctx=2048,
-            n_gpu_layers=-1,
-            verbose=True
-        )
-        print(f"Successfully loaded GGUF model: {filename}")
+        answer_cache = AnswerCache(ANSWER_CACHE_PATH or None, max_disk_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL_SECONDS)
+        print(f"Answer cache ready ({answer_cache.snapshot()['disk_entries']} entries on disk).")
     except Exception as e:
-        print(f"CRITICAL ERROR: Failed to load local GGUF model. The /predict-disease endpoint will not work. Error: {e}")
-        llm_model = None
+        print(f"ERROR: Failed to open the answer cache at '{ANSWER_CACHE_PATH}'. Falling back to memory only. Error: {e}")
+        answer_cache = AnswerCache(None, ttl=ANSWER_CACHE_TTL_SECONDS)
 
     
     print("--- Application Startup: Loading Disease Knowledge Base ---")
     try:
         knowledge_base_path = os.path.join(os.path.dirname(__file__), "disease_knowledge.json")
         with open(knowledge_base_path, 'r', encoding='utf-8') as f:
-            disease_knowledge_db = json.load(f)
+            disease_knowledge_db = normalize_diseases(json.load(f))
         print(f"Successfully loaded {len(disease_knowledge_db)} records from disease_knowledge.json.")
     except Exception as e:
         print(f"ERROR: Failed to load disease_knowledge.json. RAG will not be available. Error: {e}")
-        disease_knowledge_db = []
+        disease_knowledge_db = ()
 
     
     print("--- Application Startup: Loading Drug Knowledge Base ---")
     try:
         drug_knowledge_path = os.path.join(os.path.dirname(__file__), "data-drug.json")
         with open(drug_knowledge_path, 'r', encoding='utf-8') as f:
-            drug_knowledge_db = json.load(f)
+            drug_knowledge_db = normalize_drugs(json.load(f))
         print(f"Successfully loaded {len(drug_knowledge_db)} records from data-drug.json.")
     except Exception as e:
         print(f"ERROR: Failed to load data-drug.json. RAG will be limited. Error: {e}")
-        drug_knowledge_db = []
+        drug_knowledge_db = ()
+
+    
+    print("--- Application Startup: Building Knowledge Base Index ---")
+    knowledge_index = BM25Index(disease_knowledge_db + drug_knowledge_db)
+    print(f"Indexed {len(knowledge_index)} documents ({len(knowledge_index.vocabulary)} distinct terms).")
+
+    print("--- Application Startup: Building Symptom Spelling Index ---")
+    vocabulary_terms = list(knowledge_index.vocabulary)
+    for vocabulary_file in ("symptoms.json", "diseases.json"):
+        try:
+            with open(os.path.join(os.path.dirname(__file__), "data", vocabulary_file), 'r', encoding='utf-8') as f:
+                vocabulary_terms.extend(json.load(f))
+        except Exception as e:
+            print(f"ERROR: Failed to load data/{vocabulary_file}. Spelling correction will use a smaller vocabulary. Error: {e}")
+    spelling_index = SymSpellIndex(vocabulary_terms)
+    print(f"Spelling index built over {len(spelling_index)} canonical words.")
+    query_router = QueryRouter(disease_knowledge_db + drug_knowledge_db)
+
+    print("--- Application Startup: Loading Symptom Classifier ---")
+    try:
+        symptom_classifier = SymptomClassifier.load(SYMPTOM_FEATURES_PATH, SYMPTOM_CLASSIFIER_PATH, disease_knowledge_db)
+        disease_records_by_title = {record.title: record for record in reversed(disease_knowledge_db)}
+        mode = "trained model" if symptom_classifier.model is not None else "knowledge-base centroids"
+        print(f"Symptom classifier ready over {len(symptom_classifier.labels)} diseases ({mode}).")
+    except Exception as e:
+        print(f"ERROR: Failed to load the symptom classifier. /predict-disease/likely-conditions will not work. Error: {e}")
+        symptom_classifier = None
+
+    if RAG_RETRIEVAL_MODE in ("semantic", "hybrid"):
+        print(f"--- Application Startup: Opening Vector Store ({RAG_RETRIEVAL_MODE} retrieval) ---")
+        try:
+            if not EMBEDDING_MODEL_PATH:
+                raise ValueError("EMBEDDING_MODEL_PATH environment variable not set.")
+            vector_store = VectorStore.open(disease_knowledge_db + drug_knowledge_db, EMBEDDING_MODEL_PATH, VECTOR_STORE_PATH)
+            print(f"Memory-mapped {len(vector_store)} embeddings from '{VECTOR_STORE_PATH}'.")
+        except Exception as e:
+            print(f"ERROR: Failed to open the vector store. Falling back to keyword retrieval. Error: {e}")
+            vector_store = None
+
 
 
+def on_model_ready(model):
+    global llm_model
+    llm_model = model
+    inference_scheduler.start(llm_model, prompt_prefix=PROMPT_PREFIX)
+
+
+def require_llm_model():
+    if inference_scheduler.ready:
+        return
+    if LLM_SERVER_SOCKET:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The AI model server is not available. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+    if model_manager.state in (ModelManager.NOT_STARTED, ModelManager.LOADING, ModelManager.WARMING_UP):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The local AI model is still loading. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The local AI model is not available. Please check the server logs for errors on startup."
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_inference_scheduler():
+    await model_manager.stop()
+    await inference_scheduler.stop()
+    if answer_cache is not None:
+        answer_cache.close()
+    await chat_history_writer.stop()
+    await token_verifier.stop()
+    product_catalog.stop()
+    if storage_backend is not None:
+        await storage_backend.close()
+
+
+
+def retrieve_documents_batch(texts: list[str], top_k: int = 3):
+    """
+    Returns the top (record, score) pairs for each query using the configured
+    retrieval mode, fused with the symptom classifier's candidate diseases when
+    SYMPTOM_CLASSIFIER_RETRIEVAL is on. Every ranker scores the whole batch in
+    one vectorized call.
+    """
+    # Fusion works better with a deeper candidate list from each ranker.
+    depth = top_k * 4
+    rankers = []
+    if knowledge_index is not None and (vector_store is None or RAG_RETRIEVAL_MODE != "semantic"):
+        queries = []
+        for text in texts:
+            keywords = extract_keywords(text)
+            if spelling_index is not None:
+                # Only keywords the index cannot match at all are treated as typos.
+                keywords = [k if knowledge_index.expand(k) else spelling_index.correct(k) or k for k in keywords]
+            queries.append(keywords)
+        rankers.append(knowledge_index.search_batch(queries, top_k=depth))
+    if vector_store is not None:
+        rankers.append(vector_store.search_batch(texts, top_k=depth))
+    fuse_classifier = symptom_classifier is not None and SYMPTOM_CLASSIFIER_RETRIEVAL
+    if fuse_classifier:
+        rankers.append([
+            [(disease_records_by_title[title], probability) for title, probability in conditions if title in disease_records_by_title]
+            for conditions in symptom_classifier.rank_batch(texts, top_k=depth)
+        ])
+
+    results = []
+    for rankings in zip(*rankers):
+        if fuse_classifier and not rankings[-1]:
+            # No symptom matched: rank exactly as the retrieval mode alone would.
+            rankings = rankings[:-1]
+        if len(rankings) == 1:
+            # A single ranker keeps its own scores (ContextBuilder uses the BM25 ones).
+            results.append(rankings[0][:top_k])
+        else:
+            results.append(reciprocal_rank_fusion(rankings, top_k=top_k))
+    return results if rankers else [[] for _ in texts]
+
+
+def retrieve_documents(text: str, top_k: int = 3):
+    """Returns the top (record, score) pairs for a single query."""
+    return retrieve_documents_batch([text], top_k=top_k)[0]
+
+
+
+async def build_rag_context(question: str) -> str:
+    """Retrieves the knowledge-base context block for `question`, packed to fit the model's context window."""
+    # Embedding the query blocks, so it runs off the event loop.
+    scored_docs = await asyncio.to_thread(retrieve_documents, question, 3)
+    return await context_builder.build(scored_docs, question)
+
 
 async def save_chat_history(user_id: str, query: str, response: dict, api_endpoint: str):
-    """Saves a chat interaction to Firestore asynchronously."""
+    """
+    Queues a chat interaction for the background writer, which saves it to
+    the storage backend in a batched write shortly afterwards.
+    """
     
-    if db_firestore_client_instance is None:
-        print("Firestore client not initialized. Cannot save chat history.")
+    if not chat_history_writer.running:
+        print("Storage backend not initialized. Cannot save chat history.")
         return
     try:
-        collection_ref = db_firestore_client_instance.collection('artifacts').document(APP_ID).collection('users').document(user_id).collection('chat_history')
-        chat_entry = {
-            "user_id": user_id,
-            "query": query,
-            "response": response,
-            "api_endpoint": api_endpoint,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        }
-        await collection_ref.add(chat_entry)
-        print(f"Chat history saved for user {user_id} to Firestore.")
+        await chat_history_writer.save(user_id, query, response, api_endpoint)
     except Exception as e:
-        print(f"Error saving chat history to Firestore for user {user_id}: {e}")
+        print(f"Error queueing chat history for user {user_id}: {e}")
+
+
+async def save_chat_history_batch(user_id: str, interactions: list[tuple[str, dict]], api_endpoint: str):
+    """Queues many (query, response) interactions; the writer commits them in batches of up to 500."""
+    if not chat_history_writer.running:
+        print("Storage backend not initialized. Cannot save chat history.")
+        return
+    for query, response in interactions:
+        await save_chat_history(user_id, query, response, api_endpoint)
 
 
 
@@ -218,7 +434,7 @@ async def get_current_user_id(request: Request):
     if db_firestore_client_instance is None:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Firebase Admin SDK not initialized. Cannot authenticate.")
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = await token_verifier.verify(id_token)
         return decoded_token['uid']
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid authentication token: {e}")
@@ -240,6 +456,42 @@ class ChatResponse(BaseModel):
     response_text: str
     disclaimer: str = "This information is for general knowledge and informational purposes only, and does not constitute medical advice. Always consult a qualified healthcare professional for diagnosis and treatment."
 
+class LikelyCondition(BaseModel):
+    disease: str
+    probability: float
+
+class LikelyConditionsResponse(BaseModel):
+    conditions: list[LikelyCondition]
+    response_text: str
+    disclaimer: str = "These are statistical matches against known symptom lists, not a diagnosis. Always consult a qualified healthcare professional for diagnosis and treatment."
+
+class BatchQueryInput(BaseModel):
+    queries: list[str]
+    top_k: int = 3
+
+class RetrievedDocument(BaseModel):
+    doc_type: str
+    title: str
+    score: float
+    context: str
+
+class RetrievalResult(BaseModel):
+    query: str
+    documents: list[RetrievedDocument]
+
+class RetrievalResponse(BaseModel):
+    results: list[RetrievalResult]
+
+class BatchPredictionItem(BaseModel):
+    query: str
+    response_text: str | None = None
+    source: str | None = None  # "knowledge_base", "cache" or "llm"
+    error: str | None = None
+
+class BatchPredictionResponse(BaseModel):
+    results: list[BatchPredictionItem]
+    disclaimer: str = ChatResponse.__fields__["disclaimer"].default
+
 class NewsArticle(BaseModel):
     source_name: str | None = None
     author: str | None = None
@@ -263,8 +515,52 @@ class NewsResponse(BaseModel):
 async def root():
     
     firebase_status = "Firestore initialized." if db_firestore_client_instance else "Firestore NOT initialized."
-    llm_status = "Local LLM model loaded." if llm_model else "Local LLM model FAILED to load."
-    return {"message": f"Medizap API is running. {firebase_status} {llm_status}"}
+    storage_status = f"Storage: {storage_backend.name}." if storage_backend else "Storage NOT available."
+    if LLM_SERVER_SOCKET:
+        llm_status = "Model server connected." if inference_scheduler.ready else "Model server NOT connected."
+    else:
+        llm_status = "Local LLM model loaded." if llm_model else f"Local LLM model not loaded ({model_manager.state})."
+    return {"message": f"Medizap API is running. {firebase_status} {storage_status} {llm_status}"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the LLM is loaded and warmed up, 503 while loading or after a failure."""
+    model_status = inference_scheduler.server_status if LLM_SERVER_SOCKET else model_manager.status()
+    body = {"model": model_status, "inference_queue_depth": inference_scheduler.queue_depth}
+    if not inference_scheduler.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False, **body})
+    return {"ready": True, **body}
+
+
+@app.get("/cache/stats")
+async def get_answer_cache_stats():
+    if answer_cache is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Answer cache is not initialized.")
+    return answer_cache.snapshot()
+
+
+@app.get("/chat-history/stats")
+async def get_chat_history_stats():
+    """Counters of the background chat-history writer (queued, written, commits, retries, dropped, pending)."""
+    return chat_history_writer.snapshot()
+
+
+@app.get("/auth/stats")
+async def get_auth_stats():
+    return token_verifier.snapshot()
+
+
+@app.get("/catalog/stats")
+async def get_product_catalog_stats():
+    """State of the in-memory product replica; `ready` is false while reads still go to the storage backend."""
+    return {"enabled": products.product_catalog is not None, **product_catalog.snapshot()}
+
+
+@app.get("/llm/stats")
+async def get_llm_stats():
+    """Generation counters, tokens/sec and, with speculative decoding enabled, the accepted draft-token rate."""
+    return inference_scheduler.snapshot()
 
 
 @app.post("/predict-disease", response_model=ChatResponse)
@@ -272,150 +568,40 @@ async def get_disease_by_symptoms(input_data: TextInput, user_id: str = Depends(
     """
     Handles general medical queries by using a locally hosted GGUF model,
     augmented with a dual knowledge base (diseases and drugs) for more accurate responses (RAG).
+    Direct lookups such as "dose of <drug>" are answered from the knowledge base without the LLM.
     """
-    if not llm_model:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="The local AI model is not available. Please check the server logs for errors on startup."
-        )
-
     if not input_data.text or not input_data.text.strip():
         response = ChatResponse(response_text="I'm sorry, I can't help without a question. Please tell me what's on your mind.")
         await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease")
         return response
-        
-    
-    query_lower = input_data.text.lower()
-    
-    keywords = re.split(r'[\s,;.()]+|and', query_lower)
-    keywords = [k.strip() for k in keywords if k.strip() and len(k) > 2] 
-
-    scored_docs = []
-
-    
-    for doc in disease_knowledge_db:
-        score = 0
-        doc_disease_lower = doc.get('disease', '').lower()
-        doc_symptoms_lower = [s.lower() for s in doc.get('symptoms', [])]
-        
-        for keyword in keywords:
-            if keyword in doc_disease_lower:
-                score += 3 
-            for symptom in doc_symptoms_lower:
-                if keyword in symptom:
-                    score += 1
-        
-        if score > 0:
-            scored_docs.append({'doc': doc, 'score': score, 'type': 'disease'})
 
-    
-    
-    for doc in drug_knowledge_db:
-        score = 0
-        
-        doc_name_lower = doc.get('name', '').lower()
-        doc_indication_lower = doc.get('indication', '').lower()
-        doc_category_lower = doc.get('category', '').lower()
-        composition_str_lower = ' '.join([c.get('composition', '').lower() for c in doc.get('composition', [])])
-        side_effects_str_lower = ' '.join([s.get('side_effect', '').lower() for s in doc.get('side_effect', [])])
-        
-        
-        dose_info_lower = []
-        for d in doc.get('dose', []):
-            profil = d.get('profil', '').lower()
-            dose_text = d.get('dose', '').lower()
-            dose_info_lower.append(f"{profil} {dose_text}")
-        dose_info_str_lower = ' '.join(dose_info_lower)
-
-        
-        for keyword in keywords:
-            if keyword in doc_name_lower:
-                score += 5  
-            if keyword in dose_info_str_lower:
-                score += 4  
-            if keyword in doc_indication_lower:
-                score += 3  
-            if keyword in composition_str_lower:
-                score += 2  
-            if keyword in side_effects_str_lower:
-                score += 1  
-            if keyword in doc_category_lower:
-                score += 1
-
-        if score > 0:
-            scored_docs.append({'doc': doc, 'score': score, 'type': 'drug'})
-    
-
-    
-    context = "No specific information found in the knowledge base."
-    if scored_docs:
-        scored_docs.sort(key=lambda x: x['score'], reverse=True)
-        context_parts = []
-
-        
-        def format_list(data, key_name):
-            if not isinstance(data, list): return "N/A"
-            
-            values = [item.get(key_name) or item.get(key_name.strip() + ' ') for item in data]
-            return ', '.join(filter(None, values)) or "N/A"
-
-        
-        for item in scored_docs[:3]:
-            doc_type = item['type']
-            doc = item['doc']
-            
-            if doc_type == 'disease':
-                context_parts.append(
-                    f"Type: Disease Information\n"
-                    f"Disease: {doc.get('disease', 'N/A')}\n"
-                    f"Description: {doc.get('description', 'N/A')}\n"
-                    f"Symptoms: {', '.join(doc.get('symptoms', []))}\n"
-                    f"Common Medicines: {', '.join(doc.get('medicines', []))}"
-                )
-            elif doc_type == 'drug':
-                composition_str = format_list(doc.get('composition', []), 'composition')
-                side_effects_str = format_list(doc.get('side_effect', []), 'side_effect')
-                dose_str = ", ".join([f"{d.get('profil', 'General')}: {d.get('dose', 'N/A')}" for d in doc.get('dose', [])])
-
-                context_parts.append(
-                    f"Type: Drug Information\n"
-                    f"Drug Name: {doc.get('name', 'N/A')}\n"
-                    f"Indication: {doc.get('indication', 'N/A')}\n"
-                    f"Composition: {composition_str}\n"
-                    f"Side Effects: {side_effects_str}\n"
-                    f"Dosage: {dose_str}"
-                )
-        context = "\n\n---\n\n".join(context_parts)
-
-    
-    system_instruction = (
-        "You are an information synthesizer. Your task is to answer the user's question based *only* on the provided context, which may contain information about diseases, drugs, or both. "
-        "Summarize the information from the context in a friendly, conversational paragraph. "
-        "If the context indicates that no information was found, state that you couldn't find specific details and offer to help with another question. "
-        "Do not use your own knowledge. Do not provide a diagnosis. "
-        "Always conclude your response with a disclaimer reminding the user to consult a healthcare professional."
-    )
-    
-    prompt = f"""A chat between a curious user and an artificial intelligence assistant.
-USER: {system_instruction}
+    routed_text = query_router.answer(input_data.text) if query_router else None
+    if routed_text is not None:
+        response = ChatResponse(response_text=routed_text)
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease")
+        return response
 
-CONTEXT:
-{context}
+    require_llm_model()
+    context = await build_rag_context(input_data.text)
+    cache_key = make_cache_key(input_data.text, context)
+    cached_text = await answer_cache.aget(cache_key) if answer_cache else None
+    if cached_text is not None:
+        response = ChatResponse(response_text=cached_text)
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease")
+        return response
 
-User question: {input_data.text}
-ASSISTANT:"""
+    prompt = build_rag_prompt(input_data.text, context)
 
     try:
-        output = llm_model(
-            prompt,
-            max_tokens=256,
-            stop=["USER:", "\n"],
-            echo=False
-        )
+        output = await inference_scheduler.generate(prompt, **LLM_GENERATION_KWARGS)
         
         generated_text = output['choices'][0]['text']
         response = ChatResponse(response_text=generated_text.strip())
+        if answer_cache and response.response_text:
+            await answer_cache.aset(cache_key, response.response_text)
 
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         print(f"An unexpected error occurred during local AI prediction: {e}")
         raise HTTPException(
@@ -427,6 +613,201 @@ ASSISTANT:"""
     return response
 
 
+@app.post("/predict-disease/stream")
+async def stream_disease_by_symptoms(input_data: TextInput, user_id: str = Depends(get_current_user_id)):
+    """
+    Streaming variant of /predict-disease. Tokens are sent as Server-Sent Events
+    (`data: {"token": ...}`) as soon as the model produces them, followed by a
+    `done` event carrying the final ChatResponse, which is also saved to chat history.
+    """
+    if not input_data.text or not input_data.text.strip():
+        response = ChatResponse(response_text="I'm sorry, I can't help without a question. Please tell me what's on your mind.")
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease/stream")
+
+        async def empty_events():
+            yield f"event: done\ndata: {response.json()}\n\n"
+        return StreamingResponse(empty_events(), media_type="text/event-stream")
+
+    # Knowledge-base lookups and cached answers are sent as a single chunk.
+    async def complete_events(response: ChatResponse):
+        yield f"data: {json.dumps({'token': response.response_text})}\n\n"
+        yield f"event: done\ndata: {response.json()}\n\n"
+
+    routed_text = query_router.answer(input_data.text) if query_router else None
+    if routed_text is not None:
+        response = ChatResponse(response_text=routed_text)
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease/stream")
+        return StreamingResponse(complete_events(response), media_type="text/event-stream")
+
+    require_llm_model()
+    context = await build_rag_context(input_data.text)
+    cache_key = make_cache_key(input_data.text, context)
+    cached_text = await answer_cache.aget(cache_key) if answer_cache else None
+    if cached_text is not None:
+        response = ChatResponse(response_text=cached_text)
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease/stream")
+        return StreamingResponse(complete_events(response), media_type="text/event-stream")
+
+    prompt = build_rag_prompt(input_data.text, context)
+    # Queue admission (429/503) happens here, before the response starts.
+    token_stream = await inference_scheduler.stream(prompt, **LLM_GENERATION_KWARGS)
+
+    async def events():
+        parts = []
+        try:
+            async for token in token_stream:
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        except HTTPException as http_exc:
+            yield f"event: error\ndata: {json.dumps({'status_code': http_exc.status_code, 'detail': http_exc.detail})}\n\n"
+            return
+        except Exception as e:
+            print(f"An unexpected error occurred during streamed local AI prediction: {e}")
+            yield f"event: error\ndata: {json.dumps({'status_code': 500, 'detail': f'An unexpected error occurred during AI prediction: {e}'})}\n\n"
+            return
+        finally:
+            await token_stream.aclose()
+
+        response = ChatResponse(response_text="".join(parts).strip())
+        if answer_cache and response.response_text:
+            await answer_cache.aset(cache_key, response.response_text)
+        await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease/stream")
+        yield f"event: done\ndata: {response.json()}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def validate_batch(input_data: BatchQueryInput):
+    if not input_data.queries:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No queries given.")
+    if len(input_data.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {MAX_BATCH_QUERIES} queries."
+        )
+    if not 1 <= input_data.top_k <= 20:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="top_k must be between 1 and 20.")
+
+
+@app.post("/retrieve", response_model=RetrievalResponse)
+async def retrieve(input_data: BatchQueryInput, user_id: str = Depends(get_current_user_id)):
+    """Retrieval only: the knowledge-base documents /predict-disease would use for each query, scored in one pass."""
+    validate_batch(input_data)
+    scored = await asyncio.to_thread(retrieve_documents_batch, input_data.queries, input_data.top_k)
+    return RetrievalResponse(results=[
+        RetrievalResult(query=query, documents=[
+            RetrievedDocument(doc_type=record.doc_type, title=record.title, score=score, context=record.context)
+            for record, score in scored_docs
+        ])
+        for query, scored_docs in zip(input_data.queries, scored)
+    ])
+
+
+async def answer_from_documents(question: str, scored_docs) -> tuple[str, str]:
+    """Answers `question` from already retrieved documents; returns (text, source) where source is "cache" or "llm"."""
+    context = await context_builder.build(scored_docs, question)
+    cache_key = make_cache_key(question, context)
+    cached_text = await answer_cache.aget(cache_key) if answer_cache else None
+    if cached_text is not None:
+        return cached_text, "cache"
+
+    prompt = build_rag_prompt(question, context)
+    for attempt in range(3):
+        try:
+            output = await inference_scheduler.generate(prompt, **LLM_GENERATION_KWARGS)
+            break
+        except HTTPException as http_exc:
+            # Batch jobs wait out a full queue instead of failing the item.
+            if http_exc.status_code != status.HTTP_429_TOO_MANY_REQUESTS or attempt == 2:
+                raise
+            await asyncio.sleep(int((http_exc.headers or {}).get("Retry-After", "5")))
+    generated_text = output['choices'][0]['text'].strip()
+    if answer_cache and generated_text:
+        await answer_cache.aset(cache_key, generated_text)
+    return generated_text, "llm"
+
+
+@app.post("/predict-disease/batch", response_model=BatchPredictionResponse)
+async def predict_disease_batch(input_data: BatchQueryInput, user_id: str = Depends(get_current_user_id)):
+    """
+    Answers many questions in one request for evaluation and triage jobs.
+    The caller is authenticated once, direct lookups are answered from the
+    knowledge base, retrieval for the rest runs as one batch, prompts go
+    through the model back to back, and chat history is written in batched commits.
+    Failures are reported per item in `error`.
+    """
+    validate_batch(input_data)
+    items = [BatchPredictionItem(query=query) for query in input_data.queries]
+
+    pending = []
+    for item in items:
+        if not item.query or not item.query.strip():
+            item.error = "Empty question."
+            continue
+        routed_text = query_router.answer(item.query) if query_router else None
+        if routed_text is not None:
+            item.response_text, item.source = routed_text, "knowledge_base"
+        else:
+            pending.append(item)
+
+    if pending:
+        try:
+            require_llm_model()
+        except HTTPException as http_exc:
+            # Knowledge-base answers still go out; only the items that need the model fail.
+            for item in pending:
+                item.error = str(http_exc.detail)
+            pending = []
+
+    if pending:
+        scored = await asyncio.to_thread(retrieve_documents_batch, [item.query for item in pending], input_data.top_k)
+        # One generation running and the next already queued, so the model never idles between prompts.
+        window = asyncio.Semaphore(2)
+
+        async def answer(item: BatchPredictionItem, scored_docs):
+            async with window:
+                try:
+                    item.response_text, item.source = await answer_from_documents(item.query, scored_docs)
+                except HTTPException as http_exc:
+                    item.error = str(http_exc.detail)
+                except Exception as e:
+                    print(f"An unexpected error occurred during batched local AI prediction: {e}")
+                    item.error = f"An unexpected error occurred during AI prediction: {e}"
+
+        await asyncio.gather(*(answer(item, scored_docs) for item, scored_docs in zip(pending, scored)))
+
+    await save_chat_history_batch(
+        user_id,
+        [(item.query, item.dict()) for item in items if item.response_text is not None],
+        "/predict-disease/batch"
+    )
+    return BatchPredictionResponse(results=items)
+
+
+@app.post("/predict-disease/likely-conditions", response_model=LikelyConditionsResponse)
+async def get_likely_conditions(input_data: TextInput, user_id: str = Depends(get_current_user_id)):
+    """
+    Ranks likely conditions for a symptom description with the local symptom
+    classifier. No LLM call is made, so this answers in milliseconds.
+    """
+    if symptom_classifier is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Symptom classifier is not initialized.")
+    if not input_data.text or not input_data.text.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Please describe your symptoms.")
+
+    conditions = [LikelyCondition(disease=title, probability=round(probability, 4))
+                  for title, probability in symptom_classifier.rank(input_data.text, top_k=5)]
+    if conditions:
+        listed = ", ".join(f"{c.disease} ({c.probability:.0%})" for c in conditions)
+        response_text = f"Based on the symptoms you described, possible conditions include: {listed}."
+    else:
+        response_text = "I couldn't match your description to any known condition. Try listing your symptoms, for example \"fever, headache and chills\"."
+    response = LikelyConditionsResponse(conditions=conditions, response_text=response_text)
+
+    await save_chat_history(user_id, input_data.text, response.dict(), "/predict-disease/likely-conditions")
+    return response
+
+
 @app.post("/ocr/handwritten-text", response_model=OCRResponse)
 async def ocr_handwriting(input_data: ImageInput, user_id: str = Depends(get_current_user_id)):
     if not GOOGLE_API_KEY:
@@ -0,0 +1,148 @@
+# model_manager.py
+import asyncio
+import os
+import time
+
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+
+class PromptLookupDraftModel(LlamaDraftModel):
+    """
+    Prompt-lookup speculative drafter: proposes the tokens that followed the
+    last n-gram the last time it appeared in the prompt. Answers mostly copy
+    spans out of the retrieved context, so whole phrases get verified in one
+    batched forward pass instead of one pass per token.
+
+    Counts drafter calls and drafted tokens so the accepted-token rate can be
+    reported (see `generation_rates` in inference.py).
+    """
+
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10):
+        self._drafter = LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+        self.stats = {"draft_calls": 0, "drafted_tokens": 0}
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self._drafter(input_ids, **kwargs)
+        self.stats["draft_calls"] += 1
+        self.stats["drafted_tokens"] += len(draft)
+        return draft
+
+
+class ModelManager:
+    """
+    Loads the GGUF model in the background so the API can serve non-LLM
+    routes while the model is still loading.
+
+    A local `model_path` is preferred and loaded with mmap, so the weights are
+    paged in lazily and shared with any other process mapping the same file.
+    Without one, the model is fetched from the Hugging Face Hub (unless
+    downloads are disabled). After loading, a short warm-up generation runs so
+    the first real request doesn't pay for it. The current state is exposed
+    through `status()` for readiness checks.
+    """
+
+    NOT_STARTED = "not_started"
+    LOADING = "loading"
+    WARMING_UP = "warming_up"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, model_path: str = "", repo_id: str = "", filename: str = "",
+                 allow_download: bool = True, warmup_prompt: str = "Hello", **model_kwargs):
+        self.model_path = model_path
+        self.repo_id = repo_id
+        self.filename = filename
+        self.allow_download = allow_download
+        self.warmup_prompt = warmup_prompt
+        self.model_kwargs = model_kwargs
+        self.model = None
+        self.state = self.NOT_STARTED
+        self.error: str | None = None
+        self.load_seconds: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls):
+        """Builds a manager from the LLM_* environment variables shared by the API and the model server."""
+        return cls(
+            model_path=os.environ.get("LLM_MODEL_PATH", ""),
+            repo_id=os.environ.get("LLM_MODEL_REPO_ID", "TheBloke/Wizard-Vicuna-13B-Uncensored-GGUF"),
+            filename=os.environ.get("LLM_MODEL_FILENAME", "Wizard-Vicuna-13B-Uncensored.Q2_K.gguf"),
+            allow_download=os.environ.get("LLM_ALLOW_DOWNLOAD", "true").lower() == "true",
+            n_ctx=int(os.environ.get("LLM_N_CTX", "2048")),
+            n_gpu_layers=int(os.environ.get("LLM_N_GPU_LAYERS", "-1")),
+            draft_model=cls._draft_model_from_env(),
+            verbose=True
+        )
+
+    @staticmethod
+    def _draft_model_from_env():
+        # LLM_DRAFT_TOKENS=0 (the default) disables speculative decoding; ~10 suits CPU, ~2 GPU.
+        num_pred_tokens = int(os.environ.get("LLM_DRAFT_TOKENS", "0"))
+        if num_pred_tokens <= 0:
+            return None
+        return PromptLookupDraftModel(
+            max_ngram_size=int(os.environ.get("LLM_DRAFT_NGRAM_SIZE", "2")),
+            num_pred_tokens=num_pred_tokens
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def start(self, on_ready=None):
+        """Starts loading in a background task; `on_ready(model)` runs on the event loop once warm."""
+        self._task = asyncio.get_running_loop().create_task(self._load_in_background(on_ready))
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _load(self):
+        if self.model_path:
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(f"Model file not found at: {self.model_path}")
+            print(f"Loading local GGUF model from '{self.model_path}' (mmap)...")
+            return Llama(model_path=self.model_path, use_mmap=True, **self.model_kwargs)
+        if not self.allow_download:
+            raise ValueError("LLM_MODEL_PATH is not set and model downloads are disabled (LLM_ALLOW_DOWNLOAD=false).")
+        print(f"Downloading and loading model '{self.filename}' from '{self.repo_id}'. This may take a while on the first run...")
+        return Llama.from_pretrained(repo_id=self.repo_id, filename=self.filename, use_mmap=True, **self.model_kwargs)
+
+    def _warm_up(self, model):
+        model(self.warmup_prompt, max_tokens=1, echo=False)
+
+    async def _load_in_background(self, on_ready):
+        started = time.perf_counter()
+        try:
+            self.state = self.LOADING
+            model = await asyncio.to_thread(self._load)
+            self.state = self.WARMING_UP
+            await asyncio.to_thread(self._warm_up, model)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state = self.FAILED
+            self.error = str(e)
+            print(f"CRITICAL ERROR: Failed to load local GGUF model. The /predict-disease endpoint will not work. Error: {e}")
+            return
+
+        self.model = model
+        self.load_seconds = time.perf_counter() - started
+        if on_ready is not None:
+            on_ready(model)
+        self.state = self.READY
+        print(f"GGUF model ready after {self.load_seconds:.1f}s.")
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "source": self.model_path or f"{self.repo_id}/{self.filename}",
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
@@ -0,0 +1,257 @@
+# model_server.py
+#
+# Runs the LLM in its own process so any number of API workers can share it:
+#
+#   LLM_MODEL_PATH=/models/model.gguf LLM_SERVER_SOCKET=/tmp/medizap-llm.sock python model_server.py
+#   LLM_SERVER_SOCKET=/tmp/medizap-llm.sock uvicorn main:app --workers 4
+#
+# The protocol is newline-delimited JSON over a Unix socket, one request per
+# connection: the client sends {"op": ..., ...} and reads reply lines until
+# the connection closes.
+import asyncio
+import json
+import os
+
+from fastapi import HTTPException, status
+
+from inference import InferenceScheduler, TokenStream, generation_rates
+from model_manager import ModelManager
+from prompts import PROMPT_PREFIX
+
+_STREAM_LIMIT = 2 ** 20
+
+
+def _error_message(e: Exception) -> dict:
+    if isinstance(e, HTTPException):
+        return {"error": {"status_code": e.status_code, "detail": e.detail, "headers": e.headers}}
+    return {"error": {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": str(e)}}
+
+
+def _raise_error(error: dict):
+    if error.get("status_code") == status.HTTP_500_INTERNAL_SERVER_ERROR:
+        raise RuntimeError(error.get("detail"))
+    raise HTTPException(status_code=error["status_code"], detail=error.get("detail"), headers=error.get("headers"))
+
+
+class ModelServer:
+    """
+    Owns a small fixed pool of `Llama` instances, each behind its own
+    InferenceScheduler, and serves generation requests from API workers.
+
+    Instances load their weights with mmap from the same file, so the pool
+    shares one copy of the weights in the page cache; only the KV caches are
+    per instance. A request joins an identical in-flight generation on any
+    instance, otherwise it goes to the ready instance with the shortest queue.
+    """
+
+    def __init__(self, socket_path: str, pool_size: int = 1, max_queue_size: int = 8, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.managers = [ModelManager.from_env() for _ in range(pool_size)]
+        self.schedulers = [InferenceScheduler(max_queue_size=max_queue_size, timeout=timeout) for _ in range(pool_size)]
+
+    def status(self) -> dict:
+        return {
+            "ready": any(scheduler.ready for scheduler in self.schedulers),
+            "instances": [manager.status() for manager in self.managers],
+            "queue_depth": sum(scheduler.queue_depth for scheduler in self.schedulers),
+            "stats": generation_rates(self._total_stats()),
+        }
+
+    def _total_stats(self) -> dict:
+        totals: dict = {}
+        for scheduler in self.schedulers:
+            for name, value in scheduler.raw_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def _pick(self, prompt: str, kwargs: dict) -> InferenceScheduler:
+        ready = [scheduler for scheduler in self.schedulers if scheduler.ready]
+        if not ready:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The local AI model is not available. Please try again later."
+            )
+        for scheduler in ready:
+            if scheduler.is_inflight(prompt, **kwargs):
+                return scheduler
+        return min(ready, key=lambda scheduler: scheduler.queue_depth)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def send(message: dict):
+            writer.write(json.dumps(message).encode("utf-8") + b"\n")
+            await writer.drain()
+
+        try:
+            request = json.loads(await reader.readline())
+            op = request.get("op")
+            if op == "status":
+                await send(self.status())
+            elif op == "count_tokens":
+                scheduler = self._pick("", {})
+                await send({"counts": await scheduler.count_tokens(request["texts"])})
+            elif op == "generate":
+                scheduler = self._pick(request["prompt"], request.get("kwargs", {}))
+                await send({"result": await scheduler.generate(request["prompt"], **request.get("kwargs", {}))})
+            elif op == "stream":
+                scheduler = self._pick(request["prompt"], request.get("kwargs", {}))
+                tokens = await scheduler.stream(request["prompt"], **request.get("kwargs", {}))
+                try:
+                    await send({"accepted": True})
+                    async for token in tokens:
+                        await send({"token": token})
+                finally:
+                    await tokens.aclose()
+                await send({"done": True})
+            else:
+                await send({"error": {"status_code": status.HTTP_400_BAD_REQUEST, "detail": f"Unknown op: {op}"}})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The API worker went away; closing the token iterator above cancels its generation.
+            pass
+        except Exception as e:
+            try:
+                await send(_error_message(e))
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        for manager, scheduler in zip(self.managers, self.schedulers):
+            manager.start(on_ready=lambda model, scheduler=scheduler: scheduler.start(model, prompt_prefix=PROMPT_PREFIX))
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path, limit=_STREAM_LIMIT)
+        print(f"Model server listening on '{self.socket_path}' with {len(self.managers)} instance(s).")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for manager, scheduler in zip(self.managers, self.schedulers):
+                await manager.stop()
+                await scheduler.stop()
+
+
+class RemoteInferenceClient:
+    """
+    Drop-in replacement for InferenceScheduler used by API workers when the
+    model runs in a ModelServer process. Queueing, coalescing and prefix
+    caching all happen in the server; this client only forwards requests and
+    maps server errors back to the same HTTP errors.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 120.0, poll_interval: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.server_status: dict = {"ready": False, "error": "Not connected yet."}
+        self._poller: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.server_status.get("ready"))
+
+    @property
+    def queue_depth(self) -> int:
+        return self.server_status.get("queue_depth", 0)
+
+    def snapshot(self) -> dict:
+        """Generation statistics of the whole server pool, as of the last status poll."""
+        return self.server_status.get("stats", {})
+
+    def start(self):
+        self._poller = asyncio.get_running_loop().create_task(self._poll_status())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def _poll_status(self):
+        while True:
+            try:
+                self.server_status = await self._request_one({"op": "status"}, timeout=self.poll_interval)
+            except Exception as e:
+                self.server_status = {"ready": False, "error": f"Model server unreachable: {e}"}
+            await asyncio.sleep(self.poll_interval)
+
+    async def _open(self, request: dict):
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=_STREAM_LIMIT)
+        except OSError as e:
+            self.server_status = {"ready": False, "error": f"Model server unreachable: {e}"}
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The AI model server is not available. Please try again shortly.",
+                headers={"Retry-After": "30"}
+            )
+        writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await writer.drain()
+        return reader, writer
+
+    @staticmethod
+    async def _read(reader: asyncio.StreamReader) -> dict:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Model server closed the connection.")
+        message = json.loads(line)
+        if "error" in message:
+            _raise_error(message["error"])
+        return message
+
+    async def _request_one(self, request: dict, timeout: float) -> dict:
+        reader, writer = await self._open(request)
+        try:
+            return await asyncio.wait_for(self._read(reader), timeout=timeout)
+        finally:
+            writer.close()
+
+    async def count_tokens(self, texts: list[str]) -> list[int]:
+        message = await self._request_one({"op": "count_tokens", "texts": texts}, timeout=self.timeout)
+        return message["counts"]
+
+    async def generate(self, prompt: str, **kwargs) -> dict:
+        try:
+            # The server enforces the generation timeout; allow a little slack on top.
+            message = await self._request_one({"op": "generate", "prompt": prompt, "kwargs": kwargs}, timeout=self.timeout + 5)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="The AI assistant took too long to respond. Please try again."
+            )
+        return message["result"]
+
+    async def stream(self, prompt: str, **kwargs) -> TokenStream:
+        reader, writer = await self._open({"op": "stream", "prompt": prompt, "kwargs": kwargs})
+        try:
+            # Admission errors (429/503) arrive before the acknowledgement.
+            await asyncio.wait_for(self._read(reader), timeout=self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        # Closing early tells the server nobody is listening any more.
+        return TokenStream(self._iter_tokens(reader), writer.close, asyncio.get_running_loop())
+
+    async def _iter_tokens(self, reader: asyncio.StreamReader):
+        while True:
+            message = await asyncio.wait_for(self._read(reader), timeout=self.timeout + 5)
+            if message.get("done"):
+                break
+            yield message["token"]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    model_server = ModelServer(
+        socket_path=os.environ.get("LLM_SERVER_SOCKET", "/tmp/medizap-llm.sock"),
+        pool_size=int(os.environ.get("LLM_SERVER_POOL_SIZE", "1")),
+        max_queue_size=int(os.environ.get("LLM_QUEUE_SIZE", "8")),
+        timeout=float(os.environ.get("LLM_TIMEOUT_SECONDS", "120")),
+    )
+    asyncio.run(model_server.serve())
@@ -0,0 +1,140 @@
+# product_catalog.py
+import asyncio
+import bisect
+import copy
+
+from product_search import ProductSearchIndex
+
+
+class ProductCatalog:
+    """
+    In-process replica of the product catalog.
+
+    `start()` subscribes to the storage backend's `watch_products()` feed
+    (a Firestore `on_snapshot` listener, or the SQLite backend's own writes).
+    Its first batch delivers every product, which is the one full load, and
+    later batches carry only the products that changed. The feed calls back
+    on another thread, so each batch of changes is handed to the event loop
+    and applied there; the maps below are only ever touched from the loop.
+    Reads are served from a dict by id plus three indexes: products grouped
+    by exact name, the set of in-stock ids and a `ProductSearchIndex` for
+    ranked, case-insensitive and typo-tolerant search.
+    `ready` is False until the first snapshot is applied and after the listener
+    dies, and callers fall back to the storage backend then.
+    """
+
+    def __init__(self):
+        self.stats = {"snapshots": 0, "changes": 0, "reads": 0}
+        self._products: dict[str, dict] = {}
+        self._by_name: dict[str, set[str]] = {}
+        self._in_stock: set[str] = set()
+        self.search_index = ProductSearchIndex()
+        self._sorted_ids: list[str] | None = None
+        self._synced = False
+        self._watch = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._synced and (self._watch is None or getattr(self._watch, "is_active", True))
+
+    def start(self, storage):
+        """Subscribes to the backend's changes; must be called from the event loop that serves reads."""
+        self._loop = asyncio.get_running_loop()
+        self._watch = storage.watch_products(self._on_changes)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._synced = False
+
+    def _on_changes(self, updates):
+        # Runs on the backend's thread; apply on the loop.
+        self._loop.call_soon_threadsafe(self._apply_snapshot, updates)
+
+    def _apply_snapshot(self, updates):
+        for product_id, data in updates:
+            if data is None:
+                self.remove(product_id)
+            else:
+                self.upsert(product_id, data)
+        self.stats["snapshots"] += 1
+        self.stats["changes"] += len(updates)
+        if not self._synced:
+            self._synced = True
+            print(f"Product catalog replica loaded with {len(self._products)} products.")
+
+    # --- Maintenance (also used by the write endpoints so a client reads its own writes) ---
+
+    def upsert(self, product_id: str, data: dict):
+        self.remove(product_id)
+        self._products[product_id] = data
+        name = data.get("name")
+        if name is not None:
+            self._by_name.setdefault(name, set()).add(product_id)
+        # Same as Firestore's where('in_stock', '==', True): a product without the field is not in stock.
+        if data.get("in_stock") is True:
+            self._in_stock.add(product_id)
+        self.search_index.add(product_id, data)
+        self._sorted_ids = None
+
+    def remove(self, product_id: str):
+        data = self._products.pop(product_id, None)
+        if data is None:
+            return
+        name = data.get("name")
+        ids = self._by_name.get(name)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del self._by_name[name]
+        self._in_stock.discard(product_id)
+        self.search_index.remove(product_id)
+        self._sorted_ids = None
+
+    # --- Reads ---
+
+    def _record(self, product_id: str, fields: list[str] | None = None) -> dict:
+        data = self._products[product_id]
+        if fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        # Copies, so a caller can't change the replica by editing a response.
+        return {"id": product_id, **copy.deepcopy(data)}
+
+    def get(self, product_id: str) -> dict | None:
+        self.stats["reads"] += 1
+        if product_id not in self._products:
+            return None
+        return self._record(product_id)
+
+    def page(self, limit: int, start_after: str | None = None, fields: list[str] | None = None) -> list[dict]:
+        """Products in document-id order after `start_after`, the same order the backends page in."""
+        self.stats["reads"] += 1
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._products)
+        start = bisect.bisect_right(self._sorted_ids, start_after) if start_after else 0
+        return [self._record(product_id, fields) for product_id in self._sorted_ids[start:start + limit]]
+
+    def _filter_stock(self, ids, include_out_of_stock: bool):
+        return sorted(ids) if include_out_of_stock else sorted(ids & self._in_stock)
+
+    def find_by_name(self, name: str, include_out_of_stock: bool = False) -> list[dict]:
+        self.stats["reads"] += 1
+        ids = self._by_name.get(name, set())
+        return [self._record(product_id) for product_id in self._filter_stock(ids, include_out_of_stock)]
+
+    def search(self, query: str, include_out_of_stock: bool = False, limit: int = 50) -> list[dict]:
+        """Best matches for `query` across name, category and description, best first."""
+        self.stats["reads"] += 1
+        restrict_to = None if include_out_of_stock else self._in_stock
+        return [self._record(product_id) for product_id, _score in self.search_index.search(query, limit, restrict_to)]
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "products": len(self._products),
+            "in_stock": len(self._in_stock),
+            "names": len(self._by_name),
+        }
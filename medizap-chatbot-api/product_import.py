@@ -0,0 +1,120 @@
+# product_import.py
+import abc
+import codecs
+import csv
+import io
+import json
+import threading
+
+MAX_REPORTED_ERRORS = 1000
+
+
+def _complete_lines(buffer: str, quoted: bool) -> int:
+    """Index just past the last newline that ends a whole record (CSV quotes may span lines)."""
+    if not quoted:
+        return buffer.rfind("\n") + 1
+    end = 0
+    inside = False
+    for index, char in enumerate(buffer):
+        if char == '"':
+            inside = not inside
+        elif char == "\n" and not inside:
+            end = index + 1
+    return end
+
+
+async def iter_import_rows(chunks, content_type: str):
+    """
+    Parses a streamed NDJSON or CSV body into (row number, dict) pairs as the
+    bytes arrive, so the whole upload is never held in memory. Rows that
+    can't be parsed come back as (row number, error message) strings.
+    """
+    is_csv = "csv" in content_type
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    header = None
+    row_number = 0
+
+    def parse(lines: str):
+        nonlocal header, row_number
+        if is_csv:
+            for values in csv.reader(io.StringIO(lines)):
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                row_number += 1
+                if len(values) != len(header):
+                    yield row_number, f"Expected {len(header)} columns, got {len(values)}."
+                    continue
+                # Empty cells mean "not set", so optional fields keep their defaults.
+                yield row_number, {name: value for name, value in zip(header, values) if value != ""}
+        else:
+            # Not splitlines(): JSON strings may legally contain U+2028 and friends.
+            for line in lines.split("\n"):
+                if not line.strip():
+                    continue
+                row_number += 1
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield row_number, f"Invalid JSON: {e}"
+                    continue
+                yield row_number, row if isinstance(row, dict) else "Each line must be a JSON object."
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        end = _complete_lines(buffer, is_csv)
+        if end:
+            for row in parse(buffer[:end]):
+                yield row
+            buffer = buffer[end:]
+    buffer += decoder.decode(b"", final=True)
+    for row in parse(buffer):
+        yield row
+
+
+async def iter_drug_catalog_rows(path: str):
+    """(row number, product dict) pairs for the entries of data-drug.json, priced at their first pack size."""
+    with open(path, 'r', encoding='utf-8') as f:
+        drugs = json.load(f)
+    for row_number, drug in enumerate(drugs, start=1):
+        prices = drug.get("price") or []
+        yield row_number, {
+            "id": f"drug-{drug.get('id')}",
+            "name": drug.get("name"),
+            "description": drug.get("indication"),
+            "category": drug.get("category"),
+            "price": prices[0].get("price") if prices else None,
+            "in_stock": True,
+        }
+
+
+class ImportReport(abc.ABC):
+    """
+    Per-row outcome of a bulk import. Storage backends subclass it with an
+    async `write(rows)` taking (row number, product id, data) triples and an
+    async `close()` that returns once everything written has landed.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+        self._lock = threading.Lock()
+
+    def record_error(self, row_number: int, product_id: str | None, error: str):
+        with self._lock:
+            self.failed += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"row": row_number, "id": product_id, "error": error})
+
+    def record_written(self, count: int = 1):
+        with self._lock:
+            self.written += count
+
+    @abc.abstractmethod
+    async def write(self, rows: list):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
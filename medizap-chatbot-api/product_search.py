@@ -0,0 +1,185 @@
+# product_search.py
+import heapq
+import math
+from itertools import islice
+
+from answer_cache import normalize_query
+
+# How much a query word matching a word of each field counts towards the score.
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+# Substring and typo matching only looks at the short fields; descriptions
+# would flood every trigram with candidates.
+TRIGRAM_FIELDS = ("name", "category")
+
+
+def _trigrams(text: str) -> set[str]:
+    return {word[i:i + 3] for word in text.split() for i in range(len(word) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "postings")
+
+    def __init__(self):
+        self.children: dict[str, "_TrieNode"] = {}
+        # product id -> best field weight, for the words that end at this node.
+        self.postings: dict[str, float] = {}
+
+
+class ProductSearchIndex:
+    """
+    Case-insensitive ranked search over product names, categories and
+    descriptions.
+
+    Text is normalized with `normalize_query()`. Every word goes into a trie,
+    so each query word matches any indexed word it is a prefix of, and a
+    product must match all query words ("para 500" finds "Paracetamol
+    500mg"). Name and category words are also indexed by trigram, which finds
+    substrings ("cetamol") and misspellings ("paracetmol"): a product is a
+    candidate when at least `min_similarity` of the query's trigrams occur in
+    it. The trigram pass only runs when the prefix matches don't fill the
+    requested page. Scores add up the prefix match (weighted by field), the
+    trigram overlap and bonuses for an exact, leading or substring name match.
+
+    `add()` and `remove()` update the index in place, so it can follow the
+    catalog one product at a time. Search cost grows with the number of
+    candidates, so both passes stop at `max_candidates` products; only very
+    broad queries ("p", "amox") are cut short, and then the exact word wins
+    over longer ones. Products outside `restrict_to` (the in-stock set) are
+    skipped before they count towards that cap, so in-stock matches are
+    never crowded out by out-of-stock ones.
+    """
+
+    def __init__(self, min_similarity: float = 0.6, max_candidates: int = 200):
+        self.min_similarity = min_similarity
+        self.max_candidates = max_candidates
+        self._root = _TrieNode()
+        self._trigrams: dict[str, set[str]] = {}
+        # product id -> (normalized name, normalized category, {word: weight}, trigrams)
+        self._entries: dict[str, tuple[str, str, dict[str, float], set[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, product_id: str, data: dict):
+        """Indexes (or re-indexes) one product."""
+        self.remove(product_id)
+        fields = {field: normalize_query(str(data.get(field) or "")) for field in FIELD_WEIGHTS}
+        words: dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in fields[field].split():
+                words[word] = max(words.get(word, 0.0), weight)
+        grams = set().union(*(_trigrams(fields[field]) for field in TRIGRAM_FIELDS))
+
+        for word, weight in words.items():
+            node = self._root
+            for char in word:
+                node = node.children.setdefault(char, _TrieNode())
+            node.postings[product_id] = weight
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(product_id)
+        self._entries[product_id] = (fields["name"], fields["category"], words, grams)
+
+    def remove(self, product_id: str):
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        _name, _category, words, grams = entry
+        for word in words:
+            path = [self._root]
+            for char in word:
+                path.append(path[-1].children[char])
+            path[-1].postings.pop(product_id, None)
+            # Prune the branch back to the last node still in use.
+            for depth in range(len(word), 0, -1):
+                node = path[depth]
+                if node.postings or node.children:
+                    break
+                del path[depth - 1].children[word[depth - 1]]
+        for gram in grams:
+            ids = self._trigrams[gram]
+            ids.discard(product_id)
+            if not ids:
+                del self._trigrams[gram]
+
+    def _prefix_matches(self, prefix: str, restrict_to: set[str] | None = None) -> dict[str, float]:
+        """Best field weight of every product with a word starting with `prefix`; whole words count in full."""
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return {}
+        matches: dict[str, float] = {}
+        # Depth first reaches whole words after a few steps, so hitting the cap touches few nodes.
+        # A word that merely starts with the query counts a little less than the word itself.
+        stack = [(node, 1.0)]
+        while stack and len(matches) < self.max_candidates:
+            current, factor = stack.pop()
+            stack.extend((child, 0.8) for child in current.children.values())
+            for product_id, weight in current.postings.items():
+                if restrict_to is not None and product_id not in restrict_to:
+                    continue
+                if product_id not in matches and len(matches) >= self.max_candidates:
+                    break
+                if weight * factor > matches.get(product_id, 0.0):
+                    matches[product_id] = weight * factor
+        return matches
+
+    def _word_score(self, product_id: str, prefix: str) -> float:
+        """Best weight among the product's words starting with `prefix`, as in `_prefix_matches()`."""
+        best = 0.0
+        for word, weight in self._entries[product_id][2].items():
+            if word.startswith(prefix):
+                best = max(best, weight if len(word) == len(prefix) else weight * 0.8)
+        return best
+
+    def search(self, query: str, limit: int = 20, restrict_to: set[str] | None = None) -> list[tuple[str, float]]:
+        """Up to `limit` (product id, score) pairs, best first, optionally only among `restrict_to`."""
+        text = normalize_query(query)
+        if not text:
+            return []
+
+        words = text.split()
+        # Candidates come from the longest query word, usually the rarest; the
+        # other words are checked against each candidate's own words, so a
+        # common word ("tablet") never has to be expanded in full.
+        anchor = max(words, key=len)
+        scores = {}
+        for product_id, score in self._prefix_matches(anchor, restrict_to).items():
+            for word in words:
+                if word is not anchor:
+                    word_score = self._word_score(product_id, word)
+                    if not word_score:
+                        break
+                    score += word_score
+            else:
+                scores[product_id] = score / len(words)
+
+        grams = _trigrams(text)
+        if grams and len(scores) < limit:
+            # Substrings and typos: only needed when the prefix matches don't fill the page.
+            postings = sorted((self._trigrams.get(gram, set()) for gram in grams), key=len)
+            needed = max(1, math.ceil(self.min_similarity * len(grams)))
+            # Anything sharing `needed` trigrams shares at least one of the rarest
+            # len - needed + 1, so only those postings have to be scanned.
+            candidates = set(scores).union(*postings[:len(postings) - needed + 1])
+            if restrict_to is not None:
+                candidates &= restrict_to
+            for product_id in islice(candidates, self.max_candidates):
+                count = sum(product_id in ids for ids in postings)
+                if count >= needed or product_id in scores:
+                    scores[product_id] = scores.get(product_id, 0.0) + count / len(grams)
+
+        results = []
+        for product_id, score in scores.items():
+            name, category = self._entries[product_id][:2]
+            if name == text:
+                score += 4.0
+            elif name.startswith(text):
+                score += 2.0
+            elif text in name:
+                score += 1.5
+            elif text in category:
+                score += 0.5
+            results.append((product_id, score, name))
+        best = heapq.nsmallest(limit, results, key=lambda result: (-result[1], result[2], result[0]))
+        return [(product_id, score) for product_id, score, _name in best]
@@ -1,12 +1,18 @@
 # products.py
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Any
-from firebase_admin import firestore
+import csv
+import io
+import json
+import os
 import uuid
 
-# Import the specific client type for type hinting
-from google.cloud.firestore_v1.async_client import AsyncClient
+from product_catalog import ProductCatalog
+from product_import import iter_drug_catalog_rows, iter_import_rows
+from storage import ProductNotFound, StorageBackend
 
 router = APIRouter()
 
@@ -48,163 +54,407 @@ class ProductAvailabilityResponse(BaseModel):
     message: str = "Product availability search completed."
     disclaimer: str = "This information reflects current database stock status and may not reflect real-time physical stock."
 
+class BulkImportError(BaseModel):
+    row: int
+    id: Optional[str] = None
+    error: str
+
+class BulkImportResponse(BaseModel):
+    received: int
+    imported: int
+    failed: int
+    errors: List[BulkImportError]
+    errors_truncated: bool = False
+
+
+# --- Listing / Export Settings ---
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+# Page size used internally while streaming a full NDJSON export.
+EXPORT_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+SEARCH_RESULT_LIMIT = 50
+# Rows handed to the bulk writer at a time during an import.
+IMPORT_CHUNK_SIZE = 500
+DRUG_CATALOG_PATH = os.path.join(os.path.dirname(__file__), "data-drug.json")
+PRODUCT_FIELDS = tuple(name for name in ProductInDB.__fields__ if name != "id")
+# ProductUpdate makes these optional so they can be left out, but a stored product always has them.
+REQUIRED_PRODUCT_FIELDS = ("name", "price", "in_stock")
+
 
 # --- Dependency Injection Setup ---
 
 # This placeholder is overridden by main.py on startup
-get_firestore_client_dependency = None
+storage_backend: Optional[StorageBackend] = None
+# Set by main.py when the in-memory catalog replica is enabled.
+product_catalog: Optional[ProductCatalog] = None
+
+
+def catalog_replica() -> Optional[ProductCatalog]:
+    """The catalog replica if it is enabled and in sync, otherwise None (read from storage)."""
+    if product_catalog is not None and product_catalog.ready:
+        return product_catalog
+    return None
 
 # NEW: Create a robust dependency getter for the endpoints to use.
-# This function checks if the dependency was successfully injected from main.py.
-def get_db_client():
+# This function checks if the storage backend was successfully injected from main.py.
+def get_storage():
     """
-    Dependency function that checks if the Firestore client provider is available
-    and then calls it to get the actual client instance.
+    Dependency function that checks if a storage backend (Firestore or SQLite)
+    is configured and returns it.
     """
-    if get_firestore_client_dependency is None:
+    if storage_backend is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Firestore is not configured or available on the server."
+            detail="Product storage is not configured or available on the server."
         )
-    return get_firestore_client_dependency()
+    return storage_backend
 
-# --- CRUD Endpoints (Updated to use the new `get_db_client` dependency) ---
+# --- CRUD Endpoints (Updated to use the `get_storage` dependency) ---
 
 @router.post("/products", response_model=ProductInDB, status_code=status.HTTP_201_CREATED)
-async def create_product(product: ProductCreate, db: AsyncClient = Depends(get_db_client)):
-    products_ref = db.collection('products')
+async def create_product(product: ProductCreate, storage: StorageBackend = Depends(get_storage)):
     product_id = str(uuid.uuid4())
-    product_data = product.dict(exclude_unset=True)
-    product_data["created_at"] = firestore.SERVER_TIMESTAMP
-    product_data["updated_at"] = firestore.SERVER_TIMESTAMP
     try:
-        await products_ref.document(product_id).set(product_data)
-        created_product_doc = await products_ref.document(product_id).get()
-        if created_product_doc.exists:
-            created_product_data = created_product_doc.to_dict()
-            return ProductInDB(id=created_product_doc.id, **created_product_data)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to retrieve created product."
-            )
+        # The backend returns the stored product, timestamps included, so nothing is read back.
+        product_data = await storage.create_product(product_id, product.dict(exclude_unset=True))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error creating product: {e}"
         )
+    if product_catalog is not None:
+        product_catalog.upsert(product_id, dict(product_data))
+    return ProductInDB(id=product_id, **product_data)
 
 
 @router.get("/products/{product_id}", response_model=ProductInDB)
-async def read_product(product_id: str, db: AsyncClient = Depends(get_db_client)):
-    products_ref = db.collection('products')
-    doc_ref = products_ref.document(product_id)
-    try:
-        doc = await doc_ref.get()
-        if not doc.exists:
+async def read_product(product_id: str, storage: StorageBackend = Depends(get_storage)):
+    replica = catalog_replica()
+    if replica is not None:
+        product = replica.get(product_id)
+        if product is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-        product_data = doc.to_dict()
-        return ProductInDB(id=doc.id, **product_data)
+        return ProductInDB(**product)
+
+    try:
+        product = await storage.get_product(product_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving product: {e}"
         )
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    return ProductInDB(**product)
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Turns a comma-separated `fields=` value into a projection.
+    Returns None when no projection was requested; the id is always returned.
+    """
+    if not fields:
+        return None
+    selected = [name.strip() for name in fields.split(",") if name.strip() and name.strip() != "id"]
+    unknown = sorted(set(selected) - set(PRODUCT_FIELDS))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown product field(s): {', '.join(unknown)}. Allowed: id, {', '.join(PRODUCT_FIELDS)}."
+        )
+    return list(dict.fromkeys(selected))
+
+
+async def fetch_products_page(storage: StorageBackend, limit: int, start_after: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+    """One page of products as plain dicts (with "id"), from the replica when it is in sync."""
+    replica = catalog_replica()
+    if replica is not None:
+        return replica.page(limit, start_after, fields)
+    return await storage.list_products(limit, start_after, fields)
+
+
+async def fetch_all_products(storage: StorageBackend, fields: Optional[List[str]] = None) -> List[dict]:
+    """Every product, read EXPORT_PAGE_SIZE at a time; errors propagate to the caller."""
+    products, start_after = [], None
+    while True:
+        page = await fetch_products_page(storage, EXPORT_PAGE_SIZE, start_after, fields)
+        products.extend(page)
+        if len(page) < EXPORT_PAGE_SIZE:
+            return products
+        start_after = page[-1]["id"]
+
+
+async def iter_product_pages(storage: StorageBackend, fields: Optional[List[str]] = None, start_after: Optional[str] = None):
+    """
+    Yields every product from `start_after` onwards, EXPORT_PAGE_SIZE at a
+    time, so only a single page is ever held in memory.
+    """
+    while True:
+        try:
+            page = await fetch_products_page(storage, EXPORT_PAGE_SIZE, start_after, fields)
+        except Exception as e:
+            # Headers are already sent, so the client only sees a truncated stream.
+            print(f"Error exporting products after '{start_after}': {e}")
+            return
+        if page:
+            start_after = page[-1]["id"]
+            yield page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+
+
+async def stream_products_ndjson(storage: StorageBackend, fields: Optional[List[str]] = None, start_after: Optional[str] = None):
+    async for page in iter_product_pages(storage, fields, start_after):
+        yield "".join(json.dumps(jsonable_encoder(product)) + "\n" for product in page)
+
+
+async def stream_products_csv(storage: StorageBackend, fields: Optional[List[str]] = None, start_after: Optional[str] = None):
+    """CSV with a header row, in the column layout /products:bulkImport accepts."""
+    columns = ["id", *(fields if fields is not None else PRODUCT_FIELDS)]
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    async for page in iter_product_pages(storage, fields, start_after):
+        writer.writerows(jsonable_encoder(page))
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
 
 
 @router.get("/products", response_model=List[ProductInDB])
-async def read_all_products(db: AsyncClient = Depends(get_db_client)):
-    products_ref = db.collection('products')
+async def read_all_products(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None, description="Id of the last product on the previous page."),
+    all_products: bool = Query(False, alias="all", description="Return the whole catalog in one response instead of a page."),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. 'name,price'."),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    storage: StorageBackend = Depends(get_storage)
+):
+    """
+    Lists products in id order, one page at a time: when the page is full the
+    id to pass as `start_after` for the next page is returned in the
+    X-Next-Cursor header. `all=true` returns the whole catalog in one
+    response, as this endpoint did before paging existed; /products:export
+    streams it instead. `format=ndjson` streams every product from
+    `start_after` onwards, ignoring `limit`.
+    """
+    selected_fields = parse_fields(fields)
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_products_ndjson(storage, selected_fields, start_after),
+            media_type="application/x-ndjson"
+        )
+
     try:
-        docs = []
-        async for doc in products_ref.stream():
-            product_data = doc.to_dict()
-            docs.append(ProductInDB(id=doc.id, **product_data))
-        return docs
+        if all_products:
+            docs = await fetch_all_products(storage, selected_fields)
+        else:
+            docs = await fetch_products_page(storage, limit, start_after, selected_fields)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving products: {e}"
         )
 
+    headers = {NEXT_CURSOR_HEADER: docs[-1]["id"]} if not all_products and len(docs) == limit else {}
+    if selected_fields is not None:
+        # A projection can leave out required fields, so it skips ProductInDB validation.
+        return JSONResponse(content=jsonable_encoder(docs), headers=headers)
+    response.headers.update(headers)
+    return [ProductInDB(**product_data) for product_data in docs]
 
-@router.put("/products/{product_id}", response_model=ProductInDB)
-async def update_product(product_id: str, product_update: ProductUpdate, db: AsyncClient = Depends(get_db_client)):
-    products_ref = db.collection('products')
-    doc_ref = products_ref.document(product_id)
 
+@router.get("/products:export")
+async def export_products(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export, e.g. 'name,price'."),
+    storage: StorageBackend = Depends(get_storage)
+):
+    """
+    Streams the whole catalog as NDJSON or CSV, one page at a time. Both
+    formats can be fed straight back into /products:bulkImport.
+    """
+    selected_fields = parse_fields(fields)
+    if format == "csv":
+        body, media_type = stream_products_csv(storage, selected_fields), "text/csv"
+    else:
+        body, media_type = stream_products_ndjson(storage, selected_fields), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'}
+    )
+
+
+def validate_import_row(row: dict) -> tuple:
+    """Returns (product id, data to store) for one import row, raising ValueError if it isn't a valid product."""
+    row = dict(row)
+    product_id = str(row.pop("id", None) or "").strip() or str(uuid.uuid4())
+    if "/" in product_id:
+        raise ValueError("Product id must not contain '/'.")
+    for name in ("created_at", "updated_at"):
+        row.pop(name, None)
+    return product_id, ProductCreate(**row).dict(exclude_unset=True)
+
+
+def describe_import_error(e: ValueError) -> str:
+    if hasattr(e, "errors"):
+        return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+    return str(e)
+
+
+@router.post("/products:bulkImport", response_model=BulkImportResponse)
+async def bulk_import_products(
+    request: Request,
+    source: Optional[str] = Query(None, pattern="^data-drug$", description="Seed from the bundled data-drug.json price table instead of the request body."),
+    mode: str = Query("upsert", pattern="^(upsert|create)$", description="'create' reports rows whose id already exists instead of overwriting them."),
+    storage: StorageBackend = Depends(get_storage)
+):
+    """
+    Imports products from a streamed NDJSON (application/x-ndjson) or CSV
+    (text/csv) body with one product per line/row, in the shape accepted by
+    POST /products plus an optional "id". Rows without an id get a new one;
+    rows with one overwrite that product, so a re-run is idempotent.
+    Invalid rows and failed writes are reported by row number (the first
+    1000 of them) and never stop the rest of the import.
+    """
+    if source == "data-drug":
+        rows = iter_drug_catalog_rows(DRUG_CATALOG_PATH)
+    else:
+        rows = iter_import_rows(request.stream(), request.headers.get("content-type", "application/x-ndjson"))
+
+    importer = storage.product_importer(create_only=(mode == "create"))
+    received = 0
+    chunk = []
     try:
-        existing_doc = await doc_ref.get()
-        if not existing_doc.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        async for row_number, row in rows:
+            received += 1
+            if isinstance(row, str):
+                importer.record_error(row_number, None, row)
+                continue
+            try:
+                product_id, product_data = validate_import_row(row)
+            except ValueError as e:
+                importer.record_error(row_number, row.get("id"), describe_import_error(e))
+                continue
+            chunk.append((row_number, product_id, product_data))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await importer.write(chunk)
+                chunk = []
+        if chunk:
+            await importer.write(chunk)
+    except Exception as e:
+        print(f"Bulk import stopped after {received} rows: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Error reading import after row {received}: {e}"
+        )
+    finally:
+        # Rows already queued are still written, even if the upload broke off.
+        await importer.close()
 
-        update_data = product_update.dict(exclude_unset=True)
+    return BulkImportResponse(
+        received=received,
+        imported=importer.written,
+        failed=importer.failed,
+        errors=importer.errors,
+        errors_truncated=importer.failed > len(importer.errors)
+    )
 
-        if not update_data:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No fields provided for update."
-            )
 
-        update_data["updated_at"] = firestore.SERVER_TIMESTAMP
+@router.put("/products/{product_id}", response_model=ProductInDB)
+async def update_product(product_id: str, product_update: ProductUpdate, storage: StorageBackend = Depends(get_storage)):
+    update_data = product_update.dict(exclude_unset=True)
 
-        await doc_ref.update(update_data)
+    if not update_data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No fields provided for update."
+        )
+    null_fields = [name for name in REQUIRED_PRODUCT_FIELDS if name in update_data and update_data[name] is None]
+    if null_fields:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Field(s) cannot be null: {', '.join(null_fields)}."
+        )
 
-        updated_product_doc = await doc_ref.get()
-        if updated_product_doc.exists:
-            updated_product_data = updated_product_doc.to_dict()
-            return ProductInDB(id=updated_product_doc.id, **updated_product_data)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to retrieve updated product."
-            )
-    except HTTPException as http_exc:
-        raise http_exc
+    try:
+        updated_at = await storage.update_product(product_id, update_data)
+    except ProductNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error updating product: {e}"
         )
 
+    replica = catalog_replica()
+    cached_product = replica.get(product_id) if replica is not None else None
+    if cached_product is not None:
+        # The replica supplies the fields the request didn't touch, so no read is needed.
+        update_data["updated_at"] = updated_at
+        cached_product.update(update_data)
+        replica.upsert(product_id, {k: v for k, v in cached_product.items() if k != "id"})
+        return ProductInDB(**cached_product)
 
-@router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product(product_id: str, db: AsyncClient = Depends(get_db_client)):
-    products_ref = db.collection('products')
-    doc_ref = products_ref.document(product_id)
     try:
-        doc = await doc_ref.get()
-        if not doc.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        # The request may carry only a few fields, so the full product is read once for the response.
+        updated_product = await storage.get_product(product_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error retrieving updated product: {e}"
+        )
+    if updated_product is None:
+        # Deleted between the two calls.
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    if product_catalog is not None:
+        product_catalog.upsert(product_id, {k: v for k, v in updated_product.items() if k != "id"})
+    return ProductInDB(**updated_product)
 
-        await doc_ref.delete()
-        # Per FastAPI docs, for a 204 response, the return value is not sent.
-        # Returning None is clearer than returning a dictionary.
-        return None
+
+@router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product(product_id: str, storage: StorageBackend = Depends(get_storage)):
+    try:
+        await storage.delete_product(product_id)
+    except ProductNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting product: {e}"
         )
+    if product_catalog is not None:
+        product_catalog.remove(product_id)
+    # Per FastAPI docs, for a 204 response, the return value is not sent.
+    # Returning None is clearer than returning a dictionary.
+    return None
 
 # NEW ENDPOINT: Check Product Availability
 @router.post("/products/availability", response_model=ProductAvailabilityResponse)
-async def check_product_availability(request: ProductAvailabilityRequest, db: AsyncClient = Depends(get_db_client)):
+async def check_product_availability(request: ProductAvailabilityRequest, storage: StorageBackend = Depends(get_storage)):
     """
-    Checks the availability of a product by name in the Firestore database.
-    Can optionally include out-of-stock items.
+    Checks the availability of a product by name in the product store.
+    Can optionally include out-of-stock items. With the catalog replica, a
+    name without an exact match falls back to the closest search results.
     """
-    products_ref = db.collection('products')
-    query = products_ref.where('name', '==', request.product_name)
-
-    if not request.include_out_of_stock:
-        query = query.where('in_stock', '==', True)
-
+    replica = catalog_replica()
     available_products_list = []
     try:
-        async for doc in query.stream():
-            product_data = doc.to_dict()
-            available_products_list.append(ProductInDB(id=doc.id, **product_data))
+        if replica is not None:
+            matches = replica.find_by_name(request.product_name, request.include_out_of_stock)
+            if not matches:
+                # "paracetamol" should still find "Paracetamol 500mg".
+                matches = replica.search(request.product_name, request.include_out_of_stock, SEARCH_RESULT_LIMIT)
+            available_products_list = [ProductInDB(**product_data) for product_data in matches]
+        else:
+            matches = await storage.find_products_by_name(request.product_name, request.include_out_of_stock)
+            available_products_list = [ProductInDB(**product_data) for product_data in matches]
 
         message = ""
         if not available_products_list:
@@ -227,38 +477,34 @@ async def check_product_availability(request: ProductAvailabilityRequest, db: As
 
 # NEW ENDPOINT FOR GLOB/WILDCARD SEARCH
 @router.post("/products/search", response_model=ProductAvailabilityResponse)
-async def search_products_glob(request: ProductAvailabilityRequest, db: AsyncClient = Depends(get_db_client)):
+async def search_products_glob(request: ProductAvailabilityRequest, storage: StorageBackend = Depends(get_storage)):
     """
     Checks the availability of products using a "starts-with" search on the product name.
-    This provides a wildcard/glob-like functionality.
+    This provides a wildcard/glob-like functionality. With the catalog replica
+    the search is ranked, case-insensitive and also matches substrings, typos,
+    categories and descriptions.
     """
-    products_ref = db.collection('products')
-
+    replica = catalog_replica()
     search_term = request.product_name
-    # The \uf8ff character is a very high code point in Unicode.
-    # Appending it to the search term creates an upper bound for the query,
-    # effectively matching all strings that start with 'search_term'.
-    end_term = search_term + u'\uf8ff'
-
-    # Build the base query using the range operators for a "starts-with" search
-    query = products_ref.where('name', '>=', search_term).where('name', '<=', end_term)
-
-    if not request.include_out_of_stock:
-        query = query.where('in_stock', '==', True)
-
     available_products_list = []
     try:
-        async for doc in query.stream():
-            product_data = doc.to_dict()
-            available_products_list.append(ProductInDB(id=doc.id, **product_data))
+        if replica is not None:
+            available_products_list = [
+                ProductInDB(**product_data)
+                for product_data in replica.search(search_term, request.include_out_of_stock, SEARCH_RESULT_LIMIT)
+            ]
+        else:
+            matches = await storage.search_products_by_prefix(search_term, request.include_out_of_stock)
+            available_products_list = [ProductInDB(**product_data) for product_data in matches]
 
+        match_kind = "matching" if replica is not None else "starting with"
         message = ""
         if not available_products_list:
-            message = f"No products found starting with '{request.product_name}'."
+            message = f"No products found {match_kind} '{request.product_name}'."
             if not request.include_out_of_stock:
                 message += " (Only in-stock items were searched)."
         else:
-            message = f"Found {len(available_products_list)} product(s) starting with '{request.product_name}'."
+            message = f"Found {len(available_products_list)} product(s) {match_kind} '{request.product_name}'."
 
         return ProductAvailabilityResponse(
             product_name=request.product_name,
@@ -0,0 +1,26 @@
+# prompts.py
+
+SYSTEM_INSTRUCTION = (
+    "You are an information synthesizer. Your task is to answer the user's question based *only* on the provided context, which may contain information about diseases, drugs, or both. "
+    "Summarize the information from the context in a friendly, conversational paragraph. "
+    "If the context indicates that no information was found, state that you couldn't find specific details and offer to help with another question. "
+    "Do not use your own knowledge. Do not provide a diagnosis. "
+    "Always conclude your response with a disclaimer reminding the user to consult a healthcare professional."
+)
+
+# Everything before the retrieved context is identical for every request, so
+# the inference scheduler keeps its KV state cached (see InferenceScheduler).
+PROMPT_PREFIX = f"""A chat between a curious user and an artificial intelligence assistant.
+USER: {SYSTEM_INSTRUCTION}
+
+CONTEXT:
+"""
+
+LLM_GENERATION_KWARGS = {"max_tokens": 256, "stop": ["USER:", "\n"], "echo": False}
+
+
+def build_rag_prompt(question: str, context: str) -> str:
+    return f"""{PROMPT_PREFIX}{context}
+
+User question: {question}
+ASSISTANT:"""
@@ -0,0 +1,147 @@
+# query_router.py
+import re
+
+from answer_cache import normalize_query
+from knowledge_base import KnowledgeRecord
+
+# Patterns run on normalize_query() output (lowercase, no punctuation) with the
+# matched drug or disease name replaced by "it".
+ATTRIBUTE_PATTERNS = {
+    'drug': {
+        'dose': r'\b(doses?|dosage|dosing|how (much|many))\b',
+        'side_effect': r'\b(side ?effects?|adverse (effects?|reactions?))\b',
+        'contra_indication': r'\b(contra ?indicat\w*|who (should|must) not (take|use)|not be (taken|used) by)\b',
+        'drug_interaction': r'\b(interact\w*|taken? (it )?with other)\b',
+        'rule': r'\b(how (do|should) (i|you) (take|use)|how to (take|use)|when (to|should i) (take|use)|usage rules?|before or after|empty stomach)\b',
+        'usage_periode': r'\b(how long( (can|should) (i|you) (take|use))?|duration|usage period\w*)\b',
+        'composition': r'\b(composition|ingredients?|what does it contain)\b',
+        'indication': r'\b(used for|what is it for|indications?|what does it treat)\b',
+    },
+    'disease': {
+        'symptoms': r'\b(symptoms?|signs?)\b',
+        'medicines': r'\b(medicines?|medications?|drugs?|treatments?|treated|cure)\b',
+        'description': r'^(what is|what are|define|describe|tell me about) it$',
+    },
+}
+
+ATTRIBUTE_LABELS = {
+    'dose': "Dosage",
+    'side_effect': "Possible side effects",
+    'contra_indication': "Contraindications (do not use if)",
+    'drug_interaction': "Drug interactions",
+    'rule': "How to use",
+    'usage_periode': "Usage period",
+    'composition': "Composition",
+    'indication': "Used for",
+    'symptoms': "Common symptoms",
+    'medicines': "Common medicines",
+    'description': "About",
+}
+
+# Words that may surround the name and attribute in a plain lookup. Anything
+# else ("my child", "pregnant", "instead of") means the question needs the LLM.
+FILLER_WORDS = frozenset({
+    'it', 'its', 'of', 'the', 'a', 'an', 'for', 'what', 'whats', 'which', 'is', 'are', 'and', 'about',
+    'list', 'show', 'give', 'tell', 'me', 'please', 'pls', 'on', 'in', 'to', 'does', 'do', 'any', 'info',
+    'information', 'details', 'there',
+})
+
+# Dosage-form words dropped to build the short name people actually type ("Promag Tablet Kunyah" -> "promag").
+FORM_WORDS = frozenset({
+    'tablet', 'tablets', 'kunyah', 'cair', 'syrup', 'sirup', 'dry', 'sachet', 'suspensi', 'solution',
+    'kaplet', 'caplet', 'capsule', 'kapsul', 'tube', 'ml', 'mg',
+})
+
+MAX_VARIANTS = 4
+
+
+def _aliases(record: KnowledgeRecord) -> set[str]:
+    name = normalize_query(record.title)
+    aliases = {name, normalize_query(re.sub(r'\(.*?\)', ' ', record.title))}
+    short = ' '.join(word for word in name.split() if word not in FORM_WORDS and not word.isdigit())
+    if short:
+        aliases.add(short)
+    return {alias for alias in aliases if alias}
+
+
+class QueryRouter:
+    """
+    Answers direct knowledge-base lookups ("dose of Antasida Doen", "symptoms
+    of malaria") from the structured record fields, so only open-ended
+    questions reach the LLM.
+
+    A query is routed only when it contains a known drug or disease name, asks
+    for at least one attribute the templates cover and says nothing else
+    beyond filler words, so anything about the asker's own situation still
+    goes to the LLM. Full names win over short names; a short name that
+    covers several products (e.g. every Promag form) answers for each of them.
+    `answer()` returns None for anything it is not confident about.
+    """
+
+    def __init__(self, records):
+        self._full_names: dict[tuple[str, ...], list[KnowledgeRecord]] = {}
+        self._short_names: dict[tuple[str, ...], list[KnowledgeRecord]] = {}
+        for record in records:
+            full = normalize_query(record.title)
+            for alias in _aliases(record):
+                table = self._full_names if alias == full else self._short_names
+                matches = table.setdefault(tuple(alias.split()), [])
+                # data-drug.json lists a few products twice; keep the first copy.
+                if all(normalize_query(other.title) != full for other in matches):
+                    matches.append(record)
+        self._max_words = max((len(key) for key in (*self._full_names, *self._short_names)), default=0)
+        self._patterns = {
+            doc_type: {attribute: re.compile(pattern) for attribute, pattern in patterns.items()}
+            for doc_type, patterns in ATTRIBUTE_PATTERNS.items()
+        }
+        self.stats = {"routed": 0, "passed_to_llm": 0}
+
+    def _find_name(self, words: list[str]):
+        """Returns (records, start, end) for the longest known name in `words`, full names first on ties."""
+        for size in range(min(self._max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                key = tuple(words[start:start + size])
+                matches = self._full_names.get(key) or self._short_names.get(key)
+                if matches:
+                    return matches, start, start + size
+        return None, 0, 0
+
+    def _match(self, query: str):
+        words = normalize_query(query).split()
+        records, start, end = self._find_name(words)
+        if not records or len(records) > MAX_VARIANTS:
+            return None
+        rest = ' '.join(words[:start] + ['it'] + words[end:])
+
+        patterns = self._patterns[records[0].doc_type]
+        attributes = [attribute for attribute, pattern in patterns.items() if pattern.search(rest)]
+        if not attributes:
+            return None
+        remainder = rest
+        for attribute in attributes:
+            remainder = patterns[attribute].sub(' ', remainder)
+        if any(word not in FILLER_WORDS for word in remainder.split()):
+            return None
+        return records, attributes
+
+    def answer(self, query: str) -> str | None:
+        """Templated answer for a direct lookup, or None if the question should go to the LLM."""
+        match = self._match(query)
+        if match is None:
+            self.stats["passed_to_llm"] += 1
+            return None
+
+        records, attributes = match
+        blocks = []
+        for record in records:
+            for attribute in attributes:
+                items = record.attribute(attribute)
+                if items:
+                    lines = '\n'.join(f"- {item}" for item in items)
+                    blocks.append(f"{ATTRIBUTE_LABELS[attribute]} - {record.title}:\n{lines}")
+        if not blocks:
+            # The knowledge base has nothing on it; let the LLM explain that.
+            self.stats["passed_to_llm"] += 1
+            return None
+        self.stats["routed"] += 1
+        return '\n\n'.join(blocks)
@@ -0,0 +1,159 @@
+# retrieval.py
+import re
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from knowledge_base import KnowledgeRecord
+
+# Query keywords and document tokens are split on the same separators, so a
+# keyword (which never contains one of them) can only ever match inside a
+# single document token. Expanding a keyword to the tokens that contain it
+# therefore finds the same documents as a `keyword in field` substring check.
+KEYWORD_SPLIT_RE = re.compile(r'[\s,;.()]+|and')
+TOKEN_SPLIT_RE = re.compile(r'[\s,;.()]+')
+
+# Per-field weights applied to term frequencies before BM25 saturation.
+FIELD_WEIGHTS = {
+    'disease': 3,
+    'symptom': 1,
+    'name': 5,
+    'dose': 4,
+    'indication': 3,
+    'composition': 2,
+    'side_effect': 1,
+    'category': 1,
+}
+
+
+def extract_keywords(text: str) -> list[str]:
+    """Splits a user query into the lowercase keywords used for retrieval."""
+    keywords = KEYWORD_SPLIT_RE.split(text.lower())
+    return [k.strip() for k in keywords if k.strip() and len(k) > 2]
+
+
+class BM25Index:
+    """
+    BM25F ranker over the normalized disease and drug knowledge records.
+
+    The corpus is kept as a sparse term-document matrix (terms x docs, CSR)
+    whose entries are precomputed BM25 weights, with each field's term
+    frequency scaled by its FIELD_WEIGHTS entry. A query keyword resolves to
+    every vocabulary token that contains it (through a trigram index over the
+    vocabulary), so scoring a batch of queries is one sparse matrix product
+    followed by an argpartition top-k per query.
+    """
+
+    def __init__(self, records: list[KnowledgeRecord], k1: float = 1.2, b: float = 0.75):
+        self.docs: tuple[KnowledgeRecord, ...] = tuple(records)
+        self.vocabulary: dict[str, int] = {}
+
+        rows, cols, tfs = [], [], []
+        doc_lengths = np.zeros(len(self.docs), dtype=np.float64)
+        for doc_id, record in enumerate(self.docs):
+            term_freqs: dict[int, float] = defaultdict(float)
+            for field, text in record.fields:
+                weight = FIELD_WEIGHTS[field]
+                for token in TOKEN_SPLIT_RE.split(text):
+                    if not token:
+                        continue
+                    term_id = self.vocabulary.setdefault(token, len(self.vocabulary))
+                    term_freqs[term_id] += weight
+                    doc_lengths[doc_id] += weight
+            for term_id, tf in term_freqs.items():
+                rows.append(term_id)
+                cols.append(doc_id)
+                tfs.append(tf)
+
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float64)
+
+        n_docs = max(len(self.docs), 1)
+        doc_freqs = np.bincount(rows, minlength=len(self.vocabulary))
+        idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        avg_length = doc_lengths.mean() if len(self.docs) else 1.0
+        norm = k1 * (1 - b + b * doc_lengths[cols] / avg_length)
+        weights = idf[rows] * tfs * (k1 + 1) / (tfs + norm)
+
+        self.matrix = sparse.csr_matrix(
+            (weights, (rows, cols)), shape=(len(self.vocabulary), len(self.docs)), dtype=np.float64
+        )
+
+        self._terms = list(self.vocabulary)
+        self._trigrams: dict[str, set[str]] = defaultdict(set)
+        for token in self._terms:
+            for gram in self._grams(token):
+                self._trigrams[gram].add(token)
+        self._trigrams = dict(self._trigrams)
+        self._expansion_cache: dict[str, tuple[str, ...]] = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _grams(token: str):
+        return {token[i:i + 3] for i in range(len(token) - 2)} or {token}
+
+    def expand(self, keyword: str) -> tuple[str, ...]:
+        """Returns every indexed token that contains `keyword` as a substring."""
+        cached = self._expansion_cache.get(keyword)
+        if cached is not None:
+            return cached
+
+        candidates = None
+        for gram in sorted(self._grams(keyword), key=lambda g: len(self._trigrams.get(g, ()))):
+            tokens = self._trigrams.get(gram)
+            if not tokens:
+                candidates = set()
+                break
+            candidates = set(tokens) if candidates is None else candidates & tokens
+            if not candidates:
+                break
+
+        expanded = tuple(t for t in candidates or () if keyword in t)
+        if len(self._expansion_cache) >= 10000:
+            self._expansion_cache.clear()
+        self._expansion_cache[keyword] = expanded
+        return expanded
+
+    def query_matrix(self, queries: list[list[str]]) -> sparse.csr_matrix:
+        """
+        Builds the (queries x terms) matrix for a batch of keyword lists. An
+        exact token match counts fully; tokens that merely contain the keyword
+        count at half weight.
+        """
+        rows, cols, values = [], [], []
+        for row, keywords in enumerate(queries):
+            for keyword in keywords:
+                for token in self.expand(keyword):
+                    rows.append(row)
+                    cols.append(self.vocabulary[token])
+                    values.append(1.0 if token == keyword else 0.5)
+        # Duplicate (row, col) pairs are summed by the constructor.
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(queries), len(self.vocabulary)), dtype=np.float64)
+
+    def search_batch(self, queries: list[list[str]], top_k: int | None = None) -> list[list[tuple[KnowledgeRecord, float]]]:
+        """Scores a batch of keyword lists with a single sparse matrix product."""
+        if not queries:
+            return []
+        scores = (self.query_matrix(queries) @ self.matrix).tocsr()
+        scores.eliminate_zeros()
+
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            doc_ids = scores.indices[start:end]
+            row_scores = scores.data[start:end]
+            if top_k is not None and top_k < len(row_scores):
+                keep = np.argpartition(-row_scores, top_k - 1)[:top_k]
+                doc_ids, row_scores = doc_ids[keep], row_scores[keep]
+            # Best score first; ties keep knowledge-base order (diseases before drugs).
+            order = np.lexsort((doc_ids, -row_scores))
+            results.append([(self.docs[doc_ids[i]], float(row_scores[i])) for i in order])
+        return results
+
+    def search(self, keywords: list[str], top_k: int | None = None) -> list[tuple[KnowledgeRecord, float]]:
+        """Scores the records matching `keywords` and returns (record, score) pairs best first."""
+        return self.search_batch([keywords], top_k=top_k)[0]
@@ -0,0 +1,336 @@
+# sqlite_storage.py
+import asyncio
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from product_import import ImportReport
+from storage import ProductNotFound, StorageBackend
+
+PRODUCT_COLUMNS = ("name", "description", "price", "category", "in_stock", "image_url", "created_at", "updated_at")
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS products ("
+    "id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT, price REAL NOT NULL, category TEXT, "
+    "in_stock INTEGER NOT NULL DEFAULT 1, image_url TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)",
+    # Serves both the exact-name lookup (with or without the stock filter) and the name-prefix range scan.
+    "CREATE INDEX IF NOT EXISTS products_name_in_stock ON products (name, in_stock)",
+    "CREATE TABLE IF NOT EXISTS chat_history ("
+    "id TEXT PRIMARY KEY, app_id TEXT NOT NULL, user_id TEXT NOT NULL, query TEXT, response TEXT, "
+    "api_endpoint TEXT, timestamp TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS chat_history_user ON chat_history (app_id, user_id, timestamp)",
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _new_product(data: dict, now: datetime) -> dict:
+    """The product as its row will read back: the in_stock column defaults to true when it isn't given."""
+    return {"in_stock": True, **data, "created_at": now, "updated_at": now}
+
+
+def _to_row(data: dict) -> dict:
+    """Product fields as column values: booleans as 0/1 and timestamps as ISO 8601 text."""
+    row = {}
+    for name, value in data.items():
+        if name not in PRODUCT_COLUMNS:
+            raise ValueError(f"Unknown product field: {name}")
+        if name == "in_stock" and value is not None:
+            value = int(bool(value))
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        row[name] = value
+    return row
+
+
+def _from_row(row: sqlite3.Row) -> dict:
+    """A product row as the dict Firestore would return: unset (NULL) fields are left out."""
+    product = {}
+    for name in row.keys():
+        value = row[name]
+        if value is None:
+            continue
+        if name == "in_stock":
+            value = bool(value)
+        elif name in ("created_at", "updated_at"):
+            value = datetime.fromisoformat(value)
+        product[name] = value
+    return product
+
+
+class _Watch:
+    def __init__(self, storage: "SQLiteStorage", on_changes):
+        self.on_changes = on_changes
+        self.is_active = True
+        self._storage = storage
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self._storage._watch_lock:
+            if self in self._storage._watches:
+                self._storage._watches.remove(self)
+
+
+class SQLiteProductImporter(ImportReport):
+    """
+    Writes each chunk of import rows in a single SQLite transaction. A row
+    that violates a constraint (an existing id in create mode) only fails
+    that statement, so it is reported and the rest of the chunk commits.
+    """
+
+    def __init__(self, storage: "SQLiteStorage", create_only: bool = False):
+        super().__init__()
+        self.storage = storage
+        self.create_only = create_only
+
+    def _write(self, db: sqlite3.Connection, rows: list) -> list:
+        verb = "INSERT" if self.create_only else "INSERT OR REPLACE"
+        now = _now()
+        written = []
+        db.execute("BEGIN")
+        try:
+            for row_number, product_id, data in rows:
+                data = _new_product(data, now)
+                try:
+                    values = _to_row(data)
+                    db.execute(
+                        f"{verb} INTO products (id, {', '.join(values)}) VALUES (?{', ?' * len(values)})",
+                        (product_id, *values.values())
+                    )
+                except (sqlite3.Error, ValueError) as e:
+                    self.record_error(row_number, product_id, f"SQLite write failed: {e}")
+                    continue
+                written.append((product_id, data))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self.record_written(len(written))
+        return written
+
+    async def write(self, rows: list):
+        """Writes (row number, product id, data) triples and returns once they are committed."""
+        written = await self.storage._run_write(self._write, rows)
+        self.storage._notify(written)
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Storage in a local SQLite file, for running without Firestore (on-prem
+    deployments, development and tests).
+
+    The database runs in WAL mode, so readers never wait for the writer.
+    sqlite3 calls block, so they run on worker threads: every write goes
+    through a single writer thread and connection (SQLite allows one writer at
+    a time anyway), and reads use a small pool of threads with one connection
+    each. `watch_products()` feeds the catalog replica from the writes made
+    through this instance; writes by other processes sharing the file are not
+    seen until the replica is restarted.
+
+    Only products and chat history move here: `get_current_user_id()` still
+    verifies ID tokens with Firebase Admin, so the service account key is
+    needed for any signed-in endpoint.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, read_workers: int = 4, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+        self._write_db = self._connect()
+        for statement in SCHEMA:
+            self._write_db.execute(statement)
+        # An in-memory database only exists on its own connection, so reads share the writer's.
+        self._readers = (
+            self._writer if path == ":memory:"
+            else ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="sqlite-read")
+        )
+        self._local = threading.local()
+        self._read_dbs: list[sqlite3.Connection] = []
+        self._read_dbs_lock = threading.Lock()
+        self._watches: list[_Watch] = []
+        self._watch_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return db
+
+    def _read_db(self) -> sqlite3.Connection:
+        if self._readers is self._writer:
+            return self._write_db
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+            with self._read_dbs_lock:
+                self._read_dbs.append(db)
+        return db
+
+    async def _run_write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, fn, self._write_db, *args)
+
+    async def _run_read(self, fn, *args):
+        def run():
+            return fn(self._read_db(), *args)
+        return await asyncio.get_running_loop().run_in_executor(self._readers, run)
+
+    def _notify(self, updates: list):
+        if not updates:
+            return
+        with self._watch_lock:
+            watches = list(self._watches)
+        for watch in watches:
+            watch.on_changes(updates)
+
+    # --- Products ---
+
+    async def create_product(self, product_id: str, data: dict) -> dict:
+        data = _new_product(data, _now())
+        values = _to_row(data)
+
+        def insert(db):
+            db.execute(
+                f"INSERT INTO products (id, {', '.join(values)}) VALUES (?{', ?' * len(values)})",
+                (product_id, *values.values())
+            )
+        await self._run_write(insert)
+        self._notify([(product_id, dict(data))])
+        return data
+
+    async def get_product(self, product_id: str) -> dict | None:
+        def select(db):
+            return db.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
+        row = await self._run_read(select)
+        return _from_row(row) if row is not None else None
+
+    async def update_product(self, product_id: str, data: dict):
+        updated_at = _now()
+        values = _to_row({**data, "updated_at": updated_at})
+
+        def update(db):
+            cursor = db.execute(
+                f"UPDATE products SET {', '.join(f'{name} = ?' for name in values)} WHERE id = ?",
+                (*values.values(), product_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+            # Watchers get the whole product, read on the same connection that wrote it.
+            return db.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
+        row = await self._run_write(update)
+        if row is None:
+            raise ProductNotFound(product_id)
+        if self._watches:
+            product = _from_row(row)
+            product.pop("id")
+            self._notify([(product_id, product)])
+        return updated_at
+
+    async def delete_product(self, product_id: str):
+        def delete(db):
+            return db.execute("DELETE FROM products WHERE id = ?", (product_id,)).rowcount
+        if await self._run_write(delete) == 0:
+            raise ProductNotFound(product_id)
+        self._notify([(product_id, None)])
+
+    async def list_products(self, limit: int, start_after: str | None = None, fields: list[str] | None = None) -> list[dict]:
+        if fields is not None and not set(fields) <= set(PRODUCT_COLUMNS):
+            raise ValueError(f"Unknown product field(s): {', '.join(sorted(set(fields) - set(PRODUCT_COLUMNS)))}")
+        columns = "*" if fields is None else ", ".join(["id", *fields])
+
+        def select(db):
+            return db.execute(
+                f"SELECT {columns} FROM products WHERE id > ? ORDER BY id LIMIT ?", (start_after or "", limit)
+            ).fetchall()
+        return [_from_row(row) for row in await self._run_read(select)]
+
+    async def find_products_by_name(self, name: str, include_out_of_stock: bool = False) -> list[dict]:
+        stock_filter = "" if include_out_of_stock else " AND in_stock = 1"
+
+        def select(db):
+            return db.execute(f"SELECT * FROM products WHERE name = ?{stock_filter} ORDER BY id", (name,)).fetchall()
+        return [_from_row(row) for row in await self._run_read(select)]
+
+    async def search_products_by_prefix(self, prefix: str, include_out_of_stock: bool = False) -> list[dict]:
+        stock_filter = "" if include_out_of_stock else " AND in_stock = 1"
+
+        def select(db):
+            # The same \uf8ff upper bound as the Firestore query, so both backends match the same names.
+            return db.execute(
+                f"SELECT * FROM products WHERE name >= ? AND name <= ?{stock_filter} ORDER BY name, id",
+                (prefix, prefix + "\uf8ff")
+            ).fetchall()
+        return [_from_row(row) for row in await self._run_read(select)]
+
+    def product_importer(self, create_only: bool = False) -> SQLiteProductImporter:
+        return SQLiteProductImporter(self, create_only=create_only)
+
+    def watch_products(self, on_changes):
+        watch = _Watch(self, on_changes)
+
+        def load(db):
+            # On the writer thread, so no write can land between the full load and the subscription.
+            products = []
+            for row in db.execute("SELECT * FROM products").fetchall():
+                product = _from_row(row)
+                products.append((product.pop("id"), product))
+            on_changes(products)
+            with self._watch_lock:
+                if watch.is_active:
+                    self._watches.append(watch)
+
+        def loaded(future):
+            if not future.cancelled() and future.exception() is None:
+                return
+            # Nothing will feed the replica, so its `ready` turns false and reads fall back to storage.
+            watch.is_active = False
+            error = "cancelled" if future.cancelled() else future.exception()
+            print(f"ERROR: Failed to load products from SQLite for the catalog replica. Error: {error}")
+        self._writer.submit(load, self._write_db).add_done_callback(loaded)
+        return watch
+
+    # --- Chat history ---
+
+    async def append_chat_history(self, app_id: str, entries: list):
+        timestamp = _now().isoformat()
+        rows = [
+            (entry_id, app_id, entry["user_id"], entry.get("query"), json.dumps(entry.get("response"), default=str),
+             entry.get("api_endpoint"), timestamp)
+            for entry_id, entry in entries
+        ]
+
+        def insert(db):
+            # One transaction per batch; autocommit would sync the WAL once per entry.
+            db.execute("BEGIN")
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO chat_history (id, app_id, user_id, query, response, api_endpoint, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        await self._run_write(insert)
+
+    async def close(self):
+        with self._watch_lock:
+            for watch in self._watches:
+                watch.is_active = False
+            self._watches.clear()
+        self._writer.shutdown(wait=True)
+        if self._readers is not self._writer:
+            self._readers.shutdown(wait=True)
+        with self._read_dbs_lock:
+            for db in self._read_dbs:
+                db.close()
+            self._read_dbs.clear()
+        self._write_db.close()
@@ -0,0 +1,83 @@
+# storage.py
+import abc
+
+
+class ProductNotFound(Exception):
+    pass
+
+
+class StorageBackend(abc.ABC):
+    """
+    What the API needs from a database: product CRUD, the product listing,
+    lookup and import queries, and chat-history appends.
+
+    Products are plain dicts of the ProductBase fields; reads return them with
+    their document id under "id". Backends stamp `created_at`/`updated_at`
+    themselves. Listings are in id order and resume after the `start_after`
+    id, and `fields` (when given) limits the fields returned besides the id.
+    `FirestoreStorage` and `SQLiteStorage` implement it; a backend missing a
+    method fails when it is constructed.
+    """
+
+    name = "base"
+
+    # --- Products ---
+
+    @abc.abstractmethod
+    async def create_product(self, product_id: str, data: dict) -> dict:
+        """Stores a new product and returns it as stored, timestamps included."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_product(self, product_id: str) -> dict | None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def update_product(self, product_id: str, data: dict):
+        """Applies a partial update and returns the new `updated_at`; raises ProductNotFound."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_product(self, product_id: str):
+        """Raises ProductNotFound if there was nothing to delete."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_products(self, limit: int, start_after: str | None = None, fields: list[str] | None = None) -> list[dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def find_products_by_name(self, name: str, include_out_of_stock: bool = False) -> list[dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def search_products_by_prefix(self, prefix: str, include_out_of_stock: bool = False) -> list[dict]:
+        """Products whose name starts with `prefix` (case-sensitive), in name order."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def product_importer(self, create_only: bool = False):
+        """A `product_import.ImportReport` with async `write(rows)` and `close()` for bulk imports."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def watch_products(self, on_changes):
+        """
+        Calls `on_changes([(id, data or None for a deletion), ...])`, possibly
+        from another thread, first with every product and then with each
+        change. Returns a handle with `unsubscribe()` and `is_active`.
+        """
+        raise NotImplementedError
+
+    # --- Chat history ---
+
+    @abc.abstractmethod
+    async def append_chat_history(self, app_id: str, entries: list):
+        """
+        Writes (entry id, entry) pairs in one batch. Entry ids are chosen by
+        the caller, so retrying a batch never duplicates entries.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
@@ -0,0 +1,130 @@
+# symptom_classifier.py
+import os
+import re
+from collections import Counter
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from knowledge_base import KnowledgeRecord
+
+DEFAULT_TOKEN_PATTERN = r'(?u)\b\w\w+\b'
+
+
+class SymptomClassifier:
+    """
+    Ranks diseases for a free-text symptom description without the LLM.
+
+    Text is vectorized into the shipped TF-IDF feature space with a
+    precomputed term -> column map and the fitted IDF weights, so no sklearn
+    call is needed per request. When a trained classifier with
+    `predict_proba` is available its probabilities are used; otherwise each
+    disease is represented by the L2-normalized vector of its knowledge-base
+    symptoms and probabilities are a softmax over cosine similarities. The
+    feature model was fitted without stop words removed, so those are ignored
+    in that mode, and texts whose best cosine is under `min_similarity` get
+    no candidates. Candidates below `min_probability` are dropped, so
+    unrelated questions come back with no conditions at all.
+    """
+
+    def __init__(self, vocabulary: dict[str, int], idf: np.ndarray, token_pattern: str = DEFAULT_TOKEN_PATTERN,
+                 model=None, diseases: tuple[KnowledgeRecord, ...] = (),
+                 temperature: float = 0.1, min_similarity: float = 0.3, min_probability: float = 0.05):
+        if model is None:
+            vocabulary = {term: column for term, column in vocabulary.items() if term not in ENGLISH_STOP_WORDS}
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.token_re = re.compile(token_pattern)
+        self.model = model
+        self.temperature = temperature
+        self.min_similarity = min_similarity
+        self.min_probability = min_probability
+        if model is not None:
+            self.labels = [str(label) for label in model.classes_]
+            self.centroids = None
+        else:
+            # disease_knowledge.json has a few diseases twice; rank each name once.
+            unique: dict[str, KnowledgeRecord] = {}
+            for record in diseases:
+                unique.setdefault(record.title, record)
+            diseases = tuple(unique.values())
+            self.labels = [record.title for record in diseases]
+            # Each centroid is a unit vector, so a product with a unit query vector is the cosine.
+            symptom_text = [' '.join(record.attribute('symptoms')) for record in diseases]
+            self.centroids = self.vectorize(symptom_text).toarray().T
+
+    @classmethod
+    def load(cls, features_path: str, model_path: str = "", diseases: tuple[KnowledgeRecord, ...] = (), **kwargs):
+        """
+        Loads the feature model (a fitted TfidfVectorizer, or a plain list of
+        feature terms) and, if present, the trained classifier at `model_path`.
+        """
+        features = joblib.load(features_path)
+        if hasattr(features, 'vocabulary_'):
+            vocabulary = {term: int(column) for term, column in features.vocabulary_.items()}
+            idf = np.asarray(getattr(features, 'idf_', np.ones(len(vocabulary))), dtype=np.float32)
+            token_pattern = getattr(features, 'token_pattern', None) or DEFAULT_TOKEN_PATTERN
+        else:
+            vocabulary = {str(term).lower(): column for column, term in enumerate(features)}
+            idf = np.ones(len(vocabulary), dtype=np.float32)
+            token_pattern = DEFAULT_TOKEN_PATTERN
+
+        model = None
+        if model_path and os.path.exists(model_path):
+            model = joblib.load(model_path)
+            if not hasattr(model, 'predict_proba'):
+                raise TypeError(f"Classifier at '{model_path}' has no predict_proba().")
+        elif not diseases:
+            raise ValueError("No trained classifier found and no disease records to build centroids from.")
+        return cls(vocabulary, idf, token_pattern, model=model, diseases=diseases, **kwargs)
+
+    def vectorize(self, texts: list[str]) -> sparse.csr_matrix:
+        """L2-normalized TF-IDF rows for `texts` in the feature model's column order."""
+        indptr, indices, values = [0], [], []
+        for text in texts:
+            counts = Counter(
+                self.vocabulary[token] for token in self.token_re.findall(text.lower()) if token in self.vocabulary
+            )
+            columns = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[columns]
+            norm = np.linalg.norm(weights)
+            indices.extend(columns.tolist())
+            values.extend((weights / norm if norm else weights).tolist())
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+            shape=(len(texts), len(self.idf))
+        )
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        """Probability of every label for each text, as one (texts x labels) array."""
+        features = self.vectorize(texts)
+        if self.model is not None:
+            return np.asarray(self.model.predict_proba(features))
+        similarities = np.asarray(features @ self.centroids)
+        best = similarities.max(axis=1, keepdims=True)
+        probabilities = np.exp((similarities - best) / self.temperature)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        # Texts that barely touch any disease get an all-zero row instead of a confident-looking softmax.
+        probabilities[best[:, 0] < self.min_similarity] = 0.0
+        return probabilities
+
+    def rank_batch(self, texts: list[str], top_k: int = 5) -> list[list[tuple[str, float]]]:
+        """Top (disease, probability) pairs for each text, best first, in a single batched call."""
+        if not texts:
+            return []
+        probabilities = self.predict_proba(texts)
+        top_k = min(top_k, probabilities.shape[1])
+        top = np.argpartition(-probabilities, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for row, columns in zip(probabilities, top):
+            columns = columns[np.argsort(-row[columns], kind='stable')]
+            results.append([
+                (self.labels[column], float(row[column])) for column in columns if row[column] >= self.min_probability
+            ])
+        return results
+
+    def rank(self, text: str, top_k: int = 5) -> list[tuple[str, float]]:
+        return self.rank_batch([text], top_k=top_k)[0]
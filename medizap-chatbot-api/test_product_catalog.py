@@ -0,0 +1,189 @@
+# test_product_catalog.py
+#   cd medizap-chatbot-api && python -m pytest -q test_product_catalog.py
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from firestore_storage import FirestoreStorage
+from product_catalog import ProductCatalog
+
+
+class FakeDocument:
+    def __init__(self, doc_id: str, data: dict):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+
+class FakeWatch:
+    def __init__(self, collection: "FakeCollection", callback):
+        self.collection = collection
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self.collection.watches.remove(self)
+
+
+class FakeCollection:
+    """
+    Stands in for a synchronous Firestore collection: `on_snapshot()` delivers
+    every document as ADDED and then each write, always from another thread
+    as the real listener does.
+    """
+
+    def __init__(self, documents: dict[str, dict]):
+        self.documents = dict(documents)
+        self.watches: list[FakeWatch] = []
+
+    def _emit(self, watch: FakeWatch, changes: list):
+        thread = threading.Thread(target=watch.callback, args=(None, changes, None))
+        thread.start()
+        thread.join()
+
+    def _change(self, kind: str, doc_id: str, data: dict):
+        return SimpleNamespace(type=SimpleNamespace(name=kind), document=FakeDocument(doc_id, data))
+
+    def on_snapshot(self, callback) -> FakeWatch:
+        watch = FakeWatch(self, callback)
+        self.watches.append(watch)
+        self._emit(watch, [self._change("ADDED", doc_id, data) for doc_id, data in self.documents.items()])
+        return watch
+
+    def set(self, doc_id: str, data: dict):
+        kind = "MODIFIED" if doc_id in self.documents else "ADDED"
+        self.documents[doc_id] = dict(data)
+        for watch in list(self.watches):
+            self._emit(watch, [self._change(kind, doc_id, data)])
+
+    def delete(self, doc_id: str):
+        data = self.documents.pop(doc_id)
+        for watch in list(self.watches):
+            self._emit(watch, [self._change("REMOVED", doc_id, data)])
+
+    # --- What the Firestore queries behind the non-replica path return ---
+
+    def query_page(self, limit: int, start_after: str | None = None) -> list[dict]:
+        """order_by(document_id()).start_after(...).limit(...)"""
+        ids = sorted(doc_id for doc_id in self.documents if start_after is None or doc_id > start_after)
+        return [{"id": doc_id, **self.documents[doc_id]} for doc_id in ids[:limit]]
+
+    def query_by_name(self, name: str, include_out_of_stock: bool) -> list[dict]:
+        """where('name', '==', name) plus where('in_stock', '==', True) unless out-of-stock items are wanted."""
+        return [
+            {"id": doc_id, **data} for doc_id, data in sorted(self.documents.items())
+            if data.get("name") == name and (include_out_of_stock or data.get("in_stock") is True)
+        ]
+
+
+class FakeClient:
+    def __init__(self, collection: FakeCollection):
+        self.products = collection
+
+    def collection(self, name: str) -> FakeCollection:
+        assert name == "products"
+        return self.products
+
+
+PRODUCTS = {
+    "p3": {"name": "Paracetamol 500mg", "price": 2.5, "category": "Pain Relief", "in_stock": True},
+    "p1": {"name": "Ibuprofen 200mg", "price": 3.0, "category": "Pain Relief", "in_stock": True},
+    "p2": {"name": "Paracetamol 500mg", "price": 2.4, "category": "Pain Relief", "in_stock": False},
+    # Written without in_stock: Firestore's in_stock == True filter leaves it out.
+    "p4": {"name": "Paracetamol 500mg", "price": 2.6},
+}
+
+
+async def settle(condition, timeout: float = 2.0):
+    """Lets the loop run the changes the listener thread handed over until `condition()` holds."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "replica did not catch up"
+        await asyncio.sleep(0.01)
+
+
+async def started_catalog(collection: FakeCollection) -> ProductCatalog:
+    catalog = ProductCatalog()
+    catalog.start(FirestoreStorage(None, listener_client=FakeClient(collection)))
+    await settle(lambda: catalog.ready)
+    return catalog
+
+
+def test_initial_load():
+    async def run():
+        collection = FakeCollection(PRODUCTS)
+        catalog = ProductCatalog()
+        assert not catalog.ready
+        catalog.start(FirestoreStorage(None, listener_client=FakeClient(collection)))
+        await settle(lambda: catalog.ready)
+        assert catalog.snapshot()["products"] == 4
+        assert catalog.get("p1") == {"id": "p1", **PRODUCTS["p1"]}
+        assert catalog.get("missing") is None
+    asyncio.run(run())
+
+
+def test_changes_propagate():
+    async def run():
+        collection = FakeCollection(PRODUCTS)
+        catalog = await started_catalog(collection)
+
+        collection.set("p5", {"name": "Cetirizine 10mg", "price": 1.2, "in_stock": True})
+        await settle(lambda: catalog.get("p5") is not None)
+        assert [p["id"] for p in catalog.search("cetirizine")] == ["p5"]
+
+        collection.set("p1", {**PRODUCTS["p1"], "price": 3.5, "in_stock": False})
+        await settle(lambda: catalog.get("p1")["price"] == 3.5)
+        assert catalog.find_by_name("Ibuprofen 200mg") == []
+        assert catalog.find_by_name("Ibuprofen 200mg", include_out_of_stock=True)[0]["price"] == 3.5
+
+        collection.delete("p3")
+        await settle(lambda: catalog.get("p3") is None)
+        assert [p["id"] for p in catalog.find_by_name("Paracetamol 500mg", include_out_of_stock=True)] == ["p2", "p4"]
+        assert catalog.snapshot()["products"] == 4
+    asyncio.run(run())
+
+
+def test_not_ready_after_listener_dies():
+    async def run():
+        collection = FakeCollection(PRODUCTS)
+        catalog = await started_catalog(collection)
+        # Firestore marks the watch inactive when the stream fails for good.
+        collection.watches[0].is_active = False
+        assert not catalog.ready
+        catalog.stop()
+        assert not catalog.ready
+        assert collection.watches == []
+    asyncio.run(run())
+
+
+def test_reads_match_firestore_queries():
+    async def run():
+        collection = FakeCollection(PRODUCTS)
+        catalog = await started_catalog(collection)
+
+        for limit, start_after in [(2, None), (2, "p2"), (10, "p0"), (10, "p4"), (1, "p25")]:
+            assert catalog.page(limit, start_after) == collection.query_page(limit, start_after)
+        assert catalog.page(2, fields=["name"]) == [{"id": "p1", "name": "Ibuprofen 200mg"}, {"id": "p2", "name": "Paracetamol 500mg"}]
+
+        for include_out_of_stock in (False, True):
+            assert catalog.find_by_name("Paracetamol 500mg", include_out_of_stock) == \
+                collection.query_by_name("Paracetamol 500mg", include_out_of_stock)
+        assert catalog.find_by_name("paracetamol 500mg") == collection.query_by_name("paracetamol 500mg", False) == []
+        # Search honours the same stock filter.
+        assert [p["id"] for p in catalog.search("paracetamol")] == ["p3"]
+        assert sorted(p["id"] for p in catalog.search("paracetamol", include_out_of_stock=True)) == ["p2", "p3", "p4"]
+    asyncio.run(run())
+
+
+def test_replica_copies_are_independent():
+    async def run():
+        catalog = await started_catalog(FakeCollection(PRODUCTS))
+        product = catalog.get("p1")
+        product["price"] = 99.0
+        assert catalog.get("p1")["price"] == PRODUCTS["p1"]["price"]
+        catalog.page(1)[0]["name"] = "Changed"
+        assert catalog.get("p1") == {"id": "p1", **PRODUCTS["p1"]}
+    asyncio.run(run())
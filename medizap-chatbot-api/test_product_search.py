@@ -0,0 +1,34 @@
+# test_product_search.py
+#   cd medizap-chatbot-api && python -m pytest -q test_product_search.py
+from product_catalog import ProductCatalog
+from product_search import ProductSearchIndex
+
+
+def tablets(count: int) -> list:
+    """`count` out-of-stock tablets, more than either search pass looks at, and one in stock."""
+    products = [
+        (f"oos-{i:04d}", {"name": f"Vitamin C {i} Tablet", "category": "Supplements", "in_stock": False})
+        for i in range(count)
+    ]
+    products.append(("in-stock", {"name": "Zinc Tablet", "category": "Supplements", "in_stock": True}))
+    return products
+
+
+def test_restrict_to_applies_before_the_candidate_cap():
+    index = ProductSearchIndex(max_candidates=200)
+    for product_id, data in tablets(500):
+        index.add(product_id, data)
+    in_stock = {"in-stock"}
+    assert [product_id for product_id, _score in index.search("tablet", 20, restrict_to=in_stock)] == ["in-stock"]
+    # A prefix of the common word walks the trie below it.
+    assert [product_id for product_id, _score in index.search("tabl", 20, restrict_to=in_stock)] == ["in-stock"]
+    # Misspelt, so only the trigram pass can find it.
+    assert [product_id for product_id, _score in index.search("tablett", 20, restrict_to=in_stock)] == ["in-stock"]
+
+
+def test_catalog_search_finds_in_stock_among_many_out_of_stock():
+    catalog = ProductCatalog()
+    for product_id, data in tablets(500):
+        catalog.upsert(product_id, data)
+    assert [p["id"] for p in catalog.search("tablet")] == ["in-stock"]
+    assert len(catalog.search("tablet", include_out_of_stock=True)) == 50
@@ -0,0 +1,110 @@
+# token_verifier.py
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import auth
+
+
+class TokenVerifier:
+    """
+    Caches verified Firebase ID tokens so each token is checked once rather
+    than on every request.
+
+    Entries are keyed by the SHA-256 of the token (the token itself is never
+    stored as a key), kept in a bounded LRU and dropped once the token's `exp`
+    claim passes. Misses run `auth.verify_id_token` in a small thread pool so
+    RSA verification and certificate fetches never block the event loop, and
+    concurrent misses for the same token share one verification. A background
+    task keeps Google's public signing certificates in the Firebase SDK's HTTP
+    cache, so a verification rarely has to fetch them itself.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_workers: int = 4, cert_refresh_interval: float = 1800.0):
+        self.max_entries = max_entries
+        self.cert_refresh_interval = cert_refresh_interval
+        self.stats = {"hits": 0, "misses": 0, "failures": 0}
+        self._cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="token-verify")
+        self._refresher: asyncio.Task | None = None
+
+    def start(self):
+        self._refresher = asyncio.get_running_loop().create_task(self._refresh_certificates())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _fetch_certificates():
+        # Goes through the SDK's own cache-control session, so verify_id_token() finds the certs cached.
+        from firebase_admin import _token_gen
+        verifier = auth._get_client(None)._token_verifier
+        verifier.request(_token_gen.ID_TOKEN_CERT_URI)
+
+    async def _refresh_certificates(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(self._executor, self._fetch_certificates)
+            except Exception as e:
+                print(f"WARNING: Failed to pre-fetch Firebase public certificates. Verification will fetch them on demand. Error: {e}")
+            await asyncio.sleep(self.cert_refresh_interval)
+
+    def _lookup(self, key: str) -> dict | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _remember(self, key: str, decoded_token: dict):
+        self._cache[key] = (float(decoded_token.get('exp', 0)), decoded_token)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        self._pending.pop(key, None)
+        if not future.cancelled():
+            # Mark any error retrieved; the callers that were waiting have already seen it.
+            future.exception()
+
+    async def verify(self, id_token: str) -> dict:
+        """Returns the decoded token, raising whatever `auth.verify_id_token` raises for invalid tokens."""
+        key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+        decoded_token = self._lookup(key)
+        if decoded_token is not None:
+            self.stats["hits"] += 1
+            return decoded_token
+
+        self.stats["misses"] += 1
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(self._executor, auth.verify_id_token, id_token)
+            self._pending[key] = pending
+            pending.add_done_callback(lambda future: self._forget(key, future))
+        try:
+            # Shielded so one caller going away doesn't cancel the verification for the others.
+            decoded_token = await asyncio.shield(pending)
+        except Exception:
+            self.stats["failures"] += 1
+            raise
+        self._remember(key, decoded_token)
+        return decoded_token
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self._cache)}
@@ -0,0 +1,153 @@
+# vector_store.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from knowledge_base import KnowledgeRecord
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(__file__), "models", "knowledge_embeddings.npy")
+
+
+def _fingerprint(records: list[KnowledgeRecord], model_path: str) -> str:
+    digest = hashlib.sha256(os.path.basename(model_path).encode('utf-8'))
+    for record in records:
+        digest.update(b'\0')
+        digest.update(record.context.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorStore:
+    """
+    Dense embedding index over the knowledge records.
+
+    Record embeddings are computed once with a CPU `llama_cpp` embedding model
+    and persisted as a float32 `.npy` file next to a small metadata file. At
+    startup the matrix is memory-mapped read-only, so loading is instant and
+    the pages are shared by every worker process on the host. Queries are
+    embedded with the same model and ranked by cosine similarity.
+    """
+
+    def __init__(self, records: list[KnowledgeRecord], vectors: np.ndarray, embedder):
+        self.docs = tuple(records)
+        self.vectors = vectors
+        self._embedder = embedder
+        # A Llama context is not safe to use from several threads at once.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, records: list[KnowledgeRecord], model_path: str, store_path: str = DEFAULT_STORE_PATH):
+        """
+        Memory-maps the vector store at `store_path`, (re)building it first if
+        it is missing or was built from different records or another model.
+        """
+        from llama_cpp import Llama
+
+        embedder = Llama(model_path=model_path, embedding=True, n_gpu_layers=0, verbose=False)
+        records = tuple(records)
+        fingerprint = _fingerprint(records, model_path)
+        meta_path = store_path + ".meta.json"
+
+        meta = None
+        if os.path.exists(store_path) and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+        if not meta or meta.get('fingerprint') != fingerprint or meta.get('count') != len(records):
+            print(f"Building vector store for {len(records)} records at '{store_path}'...")
+            vectors = cls._embed(embedder, [record.context for record in records])
+            os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+            _replace_atomically(store_path, lambda f: np.save(f, vectors))
+            meta = {'fingerprint': fingerprint, 'count': len(records), 'dim': int(vectors.shape[1])}
+            _replace_atomically(meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+        vectors = np.load(store_path, mmap_mode='r')
+        return cls(records, vectors, embedder)
+
+    @staticmethod
+    def _embed(embedder, texts: list[str]) -> np.ndarray:
+        vectors = np.asarray(embedder.embed(texts), dtype=np.float32)
+        return _normalize(vectors).astype(np.float32)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def search(self, text: str, top_k: int = 3, min_score: float = 0.0) -> list[tuple[KnowledgeRecord, float]]:
+        """Returns the `top_k` records most similar to `text` as (record, cosine) pairs."""
+        return self.search_batch([text], top_k=top_k, min_score=min_score)[0]
+
+    def search_batch(self, texts: list[str], top_k: int = 3, min_score: float = 0.0) -> list[list[tuple[KnowledgeRecord, float]]]:
+        """Like `search` for many texts, embedding them in one call and scoring them in one matrix product."""
+        results: list[list[tuple[KnowledgeRecord, float]]] = [[] for _ in texts]
+        rows = [i for i, text in enumerate(texts) if text]
+        if not rows or not len(self.docs):
+            return results
+        with self._lock:
+            queries = self._embed(self._embedder, [texts[i] for i in rows])
+
+        scores = queries @ self.vectors.T
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, row_scores, columns in zip(rows, scores, top):
+            columns = columns[np.argsort(-row_scores[columns], kind='stable')]
+            results[row] = [(self.docs[i], float(row_scores[i])) for i in columns if row_scores[i] > min_score]
+        return results
+
+
+def _replace_atomically(path: str, write):
+    """
+    Writes `path` through a temporary file of its own in the same directory,
+    so workers building the store at the same time never interleave writes
+    and readers only ever see a complete file.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + ".",
+                                     suffix=".tmp", delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def reciprocal_rank_fusion(rankings: list[list[tuple[KnowledgeRecord, float]]], top_k: int = 3, k: int = 60):
+    """
+    Fuses several ranked (record, score) lists with Reciprocal Rank Fusion,
+    which only depends on ranks and so mixes BM25 and cosine scores safely.
+    """
+    fused: dict[int, list] = {}
+    for ranking in rankings:
+        for rank, (record, _score) in enumerate(ranking):
+            entry = fused.setdefault(id(record), [record, 0.0])
+            entry[1] += 1.0 / (k + rank + 1)
+    ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+    return [(record, score) for record, score in ranked[:top_k]]
+
+
+if __name__ == "__main__":
+    # Pre-builds the store so deployments start with a warm, shareable file:
+    #   EMBEDDING_MODEL_PATH=/models/embed.gguf python vector_store.py
+    from knowledge_base import normalize_diseases, normalize_drugs
+
+    base_dir = os.path.dirname(__file__)
+    with open(os.path.join(base_dir, "disease_knowledge.json"), 'r', encoding='utf-8') as f:
+        diseases = normalize_diseases(json.load(f))
+    with open(os.path.join(base_dir, "data-drug.json"), 'r', encoding='utf-8') as f:
+        drugs = normalize_drugs(json.load(f))
+
+    store = VectorStore.open(
+        diseases + drugs,
+        os.environ["EMBEDDING_MODEL_PATH"],
+        os.environ.get("VECTOR_STORE_PATH", DEFAULT_STORE_PATH),
+    )
+    print(f"Vector store ready: {store.vectors.shape[0]} vectors of dimension {store.vectors.shape[1]}.")